@@ -0,0 +1,43 @@
+"""
+Concurrent sensor acquisition for the Environment Sensor
+
+The BME680 spends most of a reading waiting for its gas heater and the
+MAX30105 waits between reading its FIFO and its temperature. Running each
+sensor's read function in its own thread lets those waits overlap, so a
+full set of readings takes as long as the slowest sensor rather than the
+sum of them all. Each I2C transfer is a single kernel call, so the sensors
+can safely share the bus from different threads.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, time
+
+# =====================================================================
+### Acquisition class ########################
+
+class Acquisition:
+    """
+    readers is a dict of sensor name -> function returning that sensor's
+    readings. sample() calls them all at once and returns a dict of
+    sensor name -> (epoch time the reading finished, readings)
+    durations holds how long (seconds) each sensor's last read took
+    """
+
+    def __init__(self, readers):
+        self.readers = dict(readers)
+        self.pool = ThreadPoolExecutor(max_workers=len(self.readers))
+        self.durations = {name: 0.0 for name in self.readers}
+
+    def _read(self, name):
+        start = monotonic()
+        readings = self.readers[name]()
+        self.durations[name] = monotonic() - start
+        return time(), readings
+
+    def sample(self):
+        futures = {name: self.pool.submit(self._read, name) for name in self.readers}
+        return {name: future.result() for name, future in futures.items()}
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+        return
@@ -0,0 +1,71 @@
+"""
+On-device aggregation of sensor readings for the Environment Sensor
+
+Keeps a running min, max, mean and last value of each channel over a fixed
+period (a minute by default) so the sensor can publish one summary per
+period instead of every reading. Pure python and fixed memory, it only
+holds the totals for the current period.
+"""
+
+from math import floor
+
+# =====================================================================
+### Aggregator class #########################
+
+class Aggregator:
+    """
+    add() readings as they are taken, once a reading falls in a new period
+    the finished period is returned as a dict of...
+        time     epoch seconds the period started
+        period   length of the period in seconds
+        count    number of readings
+        min, max, mean, last    lists with a value for each channel
+    periods are aligned to the clock, e.g. whole minutes
+    """
+
+    def __init__(self, period=60, decimals=None):
+        # values are rounded to decimals (a list with the places for each
+        # channel, e.g. codec.DECIMALS) to keep messages short
+        self.period = period
+        self.decimals = decimals
+        self.start = None
+        self.count = 0
+
+    def add(self, time_stamp, readings):
+        # time_stamp is epoch seconds, returns a finished period or None
+        start = floor(time_stamp / self.period) * self.period
+        finished = None
+        if self.start is not None and start != self.start:
+            finished = self.flush()
+        if self.count == 0:
+            self.start = start
+            self.low = list(readings)
+            self.high = list(readings)
+            self.total = list(readings)
+        else:
+            self.low = [min(a, b) for a, b in zip(self.low, readings)]
+            self.high = [max(a, b) for a, b in zip(self.high, readings)]
+            self.total = [a + b for a, b in zip(self.total, readings)]
+        self.last = list(readings)
+        self.count += 1
+        return finished
+
+    def flush(self):
+        # return the period so far (None if empty) and start again
+        if self.count == 0:
+            return None
+        rollup = {"time": self.start,
+                  "period": self.period,
+                  "count": self.count,
+                  "min": self._round(self.low),
+                  "max": self._round(self.high),
+                  "mean": self._round([t / self.count for t in self.total]),
+                  "last": self._round(self.last)}
+        self.start = None
+        self.count = 0
+        return rollup
+
+    def _round(self, values):
+        if self.decimals is None:
+            return values
+        return [round(v, d) if d else round(v) for v, d in zip(values, self.decimals)]
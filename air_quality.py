@@ -0,0 +1,97 @@
+"""
+Vectorised air quality and display formatting for the Environment Sensor
+
+Array versions of calc_air_quality, format_readings and format_air from
+main_project_v02.py, for reprocessing stored readings in one go, e.g. after
+changing the ideal humidity or the gas ceiling. Given the same float readings
+(as they are stored) they give the same results as the scalar functions,
+element by element. Readings are always formatted as floats, so a whole
+number int differs from the scalar str() formatting, e.g. format_air(0)
+gives "00%" where the scalar function gives "0%". Missing (NaN) readings,
+e.g. the smoke channel of a sensor without a particle sensor, are formatted
+as dashes ("----", "---%"), the scalar functions don't accept them.
+"""
+
+import numpy as np
+
+# =====================================================================
+### Rounding function ########################
+
+def _round(values, decimals):
+    """
+    round like python's round(value, decimals)
+    np.round scales by 10**decimals first, which can turn a value just under
+    a half (e.g. 0.15, really 0.1499999...) into an exact half and round it
+    the other way. those few near-half values are re-rounded by python
+    """
+    values = np.asarray(values, dtype=float)
+    rounded = np.round(values, decimals)
+    scaled = values * 10 ** decimals
+    near_half = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    for i in np.flatnonzero(near_half):
+        rounded.flat[i] = round(float(values.flat[i]), decimals)
+    return rounded
+
+def _str(values):
+    """
+    str() of each float, as the scalar functions format them
+    whole numbers (e.g. particle readings) are formatted in one go, any
+    others by python
+    """
+    values = np.asarray(values, dtype=float)
+    strings = np.char.mod("%.1f", values).astype(object)
+    for i in np.flatnonzero((values != np.trunc(values)) | (np.abs(values) >= 1e16)):
+        strings.flat[i] = str(float(values.flat[i]))
+    return strings.astype(str)
+
+# =====================================================================
+### Air quality functions ####################
+
+def calc_air_quality(humidity, gas, target_hum=40, max_gas=50000):
+    """
+    air quality (0 - 99.9) for arrays of humidity (%) and gas (ohms)
+    ideal humidity is target_hum and contributes 25%, gas readings of
+    max_gas or more are ideal and contribute 75%
+    """
+    humidity = np.asarray(humidity, dtype=float)
+    gas = np.asarray(gas, dtype=float)
+    hum_diff = np.abs(target_hum - humidity)
+    hum_percent = np.where(humidity < target_hum,
+                           25 - (hum_diff / target_hum * 25),
+                           25 - (hum_diff / (100 - target_hum) * 25))
+
+    gas = np.minimum(gas, max_gas)
+    gas_diff = max_gas - gas
+    gas_percent = 75 - (gas_diff / max_gas * 75)
+
+    air_quality = _round(hum_percent + gas_percent, 1)
+    return np.minimum(air_quality, 99.9)
+
+def format_air(air_quality):
+    # format readings to 4 character strings including %
+    air_quality = np.asarray(air_quality, dtype=float)
+    missing = np.isnan(air_quality)
+    air = np.char.mod("%.1f", np.where(missing, 0, air_quality))
+    return np.where(missing, "---%", np.char.add(np.char.replace(air, ".", ""), "%"))
+
+def format_readings(sensor_readings):
+    """
+    format an array of readings (one row per reading, columns as published
+    by the sensor) to 4 character strings including unit/measure
+    returns an array of strings, one row per reading with columns
+    temperature, pressure, humidity, gas and smoke
+    """
+    sensor_readings = np.asarray(sensor_readings, dtype=float)
+    # missing readings are formatted as 0 then replaced with dashes
+    missing = np.isnan(sensor_readings)
+    sensor_readings = np.where(missing, 0, sensor_readings)
+    raw_temp, raw_pres, raw_humi, raw_gas, airq, raw_smoke = sensor_readings.T
+    temp = np.char.add(np.char.replace(np.char.mod("%.1f", _round(raw_temp, 1)), ".", ""), "c")
+    pres = np.char.mod("%d", np.round(raw_pres))
+    humi = np.char.add(np.char.replace(np.char.mod("%.1f", _round(raw_humi, 1)), ".", ""), "%")
+    gas  = np.char.add(np.char.mod("%d", np.minimum(99, np.round(raw_gas / 1000))), "ko")
+    # min(9999, smoke) is the int 9999 when capped, otherwise the float
+    smoke = np.where(raw_smoke >= 9999, "9999", _str(raw_smoke))
+    columns = [np.char.rjust(column, 4) for column in [temp, pres, humi, gas, smoke]]
+    formatted = np.stack(columns, axis=-1)
+    return np.where(missing[..., [0, 1, 2, 3, 5]], "----", formatted)
@@ -0,0 +1,157 @@
+"""
+Alert rules for the Environment Sensor
+
+Each rule watches one named reading for going outside its limits or
+changing too quickly. Rules are checked incrementally as each reading is
+taken, with a hysteresis band and a minimum duration so a reading hovering
+around a limit doesn't keep raising and clearing the alert. Notifications
+are sent once when an alert is raised and once when it clears, and at most
+once every min_interval seconds per rule.
+"""
+
+from time import time
+
+# =====================================================================
+### Rule class ###############################
+
+class Rule:
+    """
+    a named alert on one channel (reading name) which is raised when...
+        the reading is below low or above high (either can be None)
+        or it changes faster than rate per second, measured over window
+        seconds, in either direction or only when "rising" or "falling"
+    for at least duration seconds. a limit alert only clears once the
+    reading is back inside the limits by hysteresis, a rate alert once the
+    rate drops below rate
+    """
+
+    def __init__(self, name, channel, low=None, high=None, hysteresis=0,
+                 duration=0, rate=None, window=60, direction=None):
+        self.name = name
+        self.channel = channel
+        self.low = low
+        self.high = high
+        self.hysteresis = hysteresis
+        self.duration = duration
+        self.rate = rate
+        self.window = window
+        if direction not in (None, "rising", "falling"):
+            raise ValueError("direction must be 'rising', 'falling' or None")
+        self.direction = direction
+        self.active = False
+        self.since = None          # time the condition started
+        self.reference = None      # (time, reading) rates are measured from
+        self.change = 0.0          # last measured rate of change
+        self.notified = False      # raise was notified, so notify the clear
+
+    def _outside(self, reading):
+        # outside the limits, or for an active alert not yet back inside
+        # them by the hysteresis margin
+        margin = self.hysteresis if self.active else 0
+        if self.low is not None and reading < self.low + margin:
+            return True
+        if self.high is not None and reading > self.high - margin:
+            return True
+        return False
+
+    def _too_fast(self, time_stamp, reading):
+        # rate is re-measured every window seconds from a reference reading,
+        # so only one earlier reading needs to be kept
+        if self.rate is None:
+            return False
+        if self.reference is None:
+            self.reference = (time_stamp, reading)
+            return False
+        start, start_reading = self.reference
+        if time_stamp - start >= self.window:
+            self.change = (reading - start_reading) / (time_stamp - start)
+            self.reference = (time_stamp, reading)
+        if self.direction == "rising":
+            return self.change > self.rate
+        if self.direction == "falling":
+            return -self.change > self.rate
+        return abs(self.change) > self.rate
+
+    def check(self, time_stamp, reading):
+        """
+        add a reading taken at epoch time_stamp
+        returns "raised" or "cleared" when the alert changes, else None
+        """
+        too_fast = self._too_fast(time_stamp, reading)
+        condition = too_fast or self._outside(reading)
+        if not condition:
+            self.since = None
+            if self.active:
+                self.active = False
+                return "cleared"
+            return None
+        if self.since is None:
+            self.since = time_stamp
+        if not self.active and time_stamp - self.since >= self.duration:
+            self.active = True
+            return "raised"
+        return None
+
+    def limits(self):
+        return {"low": self.low, "high": self.high, "rate": self.rate}
+
+# =====================================================================
+### Alert engine class #######################
+
+class AlertEngine:
+    """
+    checks every rule against each set of readings and passes alert events
+    to the notifiers, functions called with a dict of...
+        time, rule, channel, state ("raised" or "cleared"), reading, limits
+    channels names the readings in the order they are taken
+    """
+
+    def __init__(self, channels, rules, notifiers=(), min_interval=300):
+        self.channels = list(channels)
+        self.rules = list(rules)
+        self.notifiers = list(notifiers)
+        self.min_interval = min_interval
+        self.last_notified = {}
+        self.suppressed = 0       # notifications skipped by the rate limit
+        for rule in self.rules:
+            if rule.channel not in self.channels:
+                raise ValueError("unknown channel %r in rule %r" % (rule.channel, rule.name))
+
+    def update(self, readings, time_stamp=None):
+        # check a set of readings, returns the events raised or cleared
+        if time_stamp is None:
+            time_stamp = time()
+        events = []
+        for rule in self.rules:
+            reading = readings[self.channels.index(rule.channel)]
+            state = rule.check(time_stamp, reading)
+            if state is None:
+                continue
+            event = {"time": time_stamp, "rule": rule.name, "channel": rule.channel,
+                     "state": state, "reading": reading, "limits": rule.limits()}
+            events.append(event)
+            self._notify(rule, event)
+        return events
+
+    def _notify(self, rule, event):
+        # a rule is notified at most once every min_interval seconds, and a
+        # clear only if its raise was notified
+        if event["state"] == "raised":
+            last = self.last_notified.get(rule.name)
+            if last is not None and event["time"] - last < self.min_interval:
+                self.suppressed += 1
+                rule.notified = False
+                return
+            self.last_notified[rule.name] = event["time"]
+            rule.notified = True
+        elif not rule.notified:
+            return
+        else:
+            rule.notified = False
+        for notifier in self.notifiers:
+            notifier(event)
+        return
+
+    def active(self):
+        # names of the rules currently raised
+        return [rule.name for rule in self.rules if rule.active]
@@ -7,38 +7,237 @@ import dash_core_components as dcc
 import dash_html_components as html
 import dash_daq as daq
 import plotly
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from flask import Response, request
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
 import time
 import json
 import os
+import fcntl
+import queue
+import threading
+import numpy as np
+from history import RingBuffer, SegmentStore, Rollup, lttb, min_max, bucket_stats, unlink_shared
+from fleet import Fleet
+from codec import decode_batch
+from metrics import registry, timed
+from cache import LRUCache
 
 ###############################################################################
 
-# set up initial dictionary to record sensor readings for line graphs
+# set up ring buffer to record sensor readings for line graphs
+# history_capacity sets how many rows are kept (2 days of 1 second data)
+# data_range sets how many seconds of history are drawn on the graphs by default
+# channels are in the same order as the readings published by the sensor
 readings = [0, 0, 0, 0, 0, 0]
 data_range = 100
-start_time = datetime.now() - timedelta(seconds=data_range)
-data = {
-    'Time': [start_time + timedelta(seconds=x) for x in range(data_range)],
-    'Temperature': [0 for x in range(data_range)],
-    "Pressure": [0 for x in range(data_range)],
-    "Humidity": [0 for x in range(data_range)],
-    "Gas": [0 for x in range(data_range)],
-    "Smoke": [0 for x in range(data_range)],
-    "AirQ": [0 for x in range(data_range)]}
+history_capacity = 2 * 24 * 60 * 60
+channels = ["Temperature", "Pressure", "Humidity", "Gas", "AirQ", "Smoke"]
+history_dir = os.environ.get("HISTORY_DIR", "history")
+
+# when running several worker processes (e.g. gunicorn -w 4 -k gthread
+# --threads 8, see push_mode for the worker class) set SHARED_MEMORY_NAME so the ring buffers and fleet table are kept in shared
+# memory. only the first process to lock ingest.lock connects to AWS IoT and
+# writes the history, the others read the shared memory and try for the lock
+# every ingest_retry seconds, so one of them takes over if it exits. without
+# a name each process keeps its own copy, as when running application.py
+# directly. the shared memory outlives the workers, call unlink_shared_memory()
+# once when the whole server stops (e.g. from gunicorn's on_exit hook)
+shared_name = os.environ.get("SHARED_MEMORY_NAME")
+shared_suffixes = ["data", "1min", "1hour", "fleet"]
+ingest_retry = 5
+
+def shared(suffix):
+    # shared memory name for one of the buffers, or None if not sharing
+    if shared_name is None:
+        return None
+    return shared_name + "_" + suffix
+
+def unlink_shared_memory():
+    if shared_name is None:
+        return
+    for suffix in shared_suffixes:
+        unlink_shared(shared(suffix))
+    return
+
+def acquire_ingest_lock():
+    # returns the open lock file (or True when not sharing memory) if this
+    # process should ingest MQTT messages, None otherwise
+    if shared_name is None:
+        return True
+    lock_file = open(os.path.join(history_dir, "ingest.lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+# the ring buffer, on-disk store, rollups and fleet table are set up by
+# start(). the ring buffer keeps the last 2 days at 1 second resolution for
+# the graphs, every reading is also appended to day-by-day files on disk,
+# and 1 minute (60 days) and 1 hour (2 years) rollups are kept for graphing
+# long periods
+ingest_lock = None
+ingest = False
+data = None
+store = None
+rollups = []
+
+# each graph is drawn with at most one point per horizontal pixel, and
+# a resolution is only used if it needs fewer than max_rows rows
+graph_width = 1600
+graph_points = graph_width // 4
+max_rows = graph_points * 50
+
+# in push mode each new reading is sent straight to the browsers over a
+# server-sent events stream (needs Dash 2.16+ for dash_clientside.set_props),
+# the interval then only fires every resync_interval ms to redraw long graphs.
+# each open stream holds a request handler for as long as the page is open,
+# so push mode needs a server that handles requests on threads or greenlets:
+# application.py run directly, or gunicorn with -k gthread (and enough
+# --threads for the open pages) or -k gevent. gunicorn's default sync
+# workers would be used up by a few pages (and time out streams after 30
+# seconds), so pages served by them poll every 2 seconds instead
+push_mode = True
+resync_interval = 60 * 1000
+subscribers = set()
+subscribers_lock = threading.Lock()
+
+# figures, graph updates and gauge values are cached by data version (the
+# number of readings recorded) so all the browsers open on the dashboard
+# share one copy of each, cache_size sets how many are kept
+cache_size = 64
+responses = LRUCache(cache_size)
+
+# every sensor publishes to sensors/<client id>/readings, the latest reading
+# and the last fleet_history readings of each device are kept for the fleet
+# page. the home_device also feeds the gauges, graphs and on-disk history
+home_device = os.environ.get("HOME_DEVICE", "basicPubSub")
+fleet_history = 60
+fleet = None
 
 
 ###############################################################################
 # Custom MQTT message callback
+@timed("dashboard_mqtt_receive_seconds", "time to decode and record an MQTT message")
 def customCallback(client, userdata, message):
+    # a message that can't be decoded (from any device on the topic) is
+    # logged, counted and dropped rather than raised into the MQTT client
+    try:
+        device_id, batch = decode_message(message)
+    except Exception as e:
+        print("dropped bad message on %s: %r" % (message.topic, e))
+        registry.counter("dashboard_bad_messages_total",
+                         "MQTT messages dropped because they couldn't be decoded").inc()
+        return
+    for time_stamp, readings, spread in batch:
+        record_reading(device_id, time_stamp, readings, spread)
+    return
+
+def decode_message(message):
+    # returns the device id and a list of (time stamp, readings, spread)
+    # from one message. messages are either a binary batch of readings (see
+    # codec.py), a JSON rollup from a sensor in rollup mode (recorded as its
+    # mean at the start of the period, with its min and max going into the
+    # rollup buckets), or the older single JSON reading, which is stamped
+    # with the time received
+    levels = message.topic.split("/")
+    if len(levels) != 3 or levels[0] != "sensors" or levels[2] != "readings":
+        raise ValueError("unexpected topic")
+    device_id = levels[1]
+    payload = message.payload
+    if payload[:1] == b"{":
+        m = json.loads(payload.decode())
+        if "rollup" in m:
+            rollup = m["rollup"]
+            spread = (rollup["min"], rollup["max"], int(rollup["count"]))
+            batch = [(datetime.fromtimestamp(rollup["time"]), rollup["mean"], spread)]
+        else:
+            batch = [(datetime.now(), m["readings"], None)]
+    else:
+        batch = [(datetime.fromtimestamp(t), r, None) for t, r in decode_batch(payload)]
+        # time from each reading being taken on the sensor to arriving here
+        received = datetime.now()
+        age = registry.histogram("dashboard_reading_age_seconds",
+                                 "time from a reading being taken to it being received")
+        for time_stamp, readings, spread in batch:
+            age.observe(max(0.0, (received - time_stamp).total_seconds()))
+    padded = []
+    for time_stamp, readings, spread in batch:
+        # a sensor publishing fewer channels (e.g. no particle sensor) has
+        # the rest recorded as missing, as RingBuffer.append does for dicts
+        readings = pad_channels(readings)
+        if spread is not None:
+            low, high, count = spread
+            spread = (pad_channels(low), pad_channels(high), count)
+        padded.append((time_stamp, readings, spread))
+    return device_id, padded
+
+def pad_channels(values):
+    # values for each channel as floats, NaN (missing) for any not sent
+    return ([float(value) for value in values] + [np.nan] * len(channels))[:len(channels)]
+
+def record_reading(device_id, time_stamp, reading, spread=None):
+    # spread is (min, max, count) when the reading is the mean of a rollup
     global readings
-    m = json.loads(message.payload.decode())
-    readings = [m["readings"]]
-    readings = readings[0]
+    fleet.record(device_id, time_stamp, reading)
+    if device_id != home_device:
+        return
+    readings = reading
     print(readings)
+    # record reading in memory for the graphs and on disk for history
+    data.append(time_stamp, readings)
+    store.append(time_stamp, readings)
+    for rollup in rollups:
+        if spread is None:
+            rollup.add(time_stamp, readings)
+        else:
+            rollup.add(time_stamp, readings, *spread)
+    broadcast(time_stamp, readings)
+    return
+
+def broadcast(time_stamp, readings):
+    # send a reading to every connected browser, clients that fall more
+    # than a queue's worth of messages behind miss readings instead of
+    # holding up the MQTT thread. missing (NaN) readings are sent as null,
+    # JSON.parse doesn't accept NaN
+    time_ms = int(np.datetime64(time_stamp, "ms").astype(np.int64))
+    readings = [None if value != value else value for value in readings]
+    message = json.dumps({"time": time_ms, "readings": readings}, allow_nan=False)
+    with subscribers_lock:
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((time_ms, message))
+            except queue.Full:
+                pass
     return
 
+def watch_shared():
+    # worker processes that don't ingest MQTT messages watch the shared
+    # ring buffer for new readings to push to their own browsers, until
+    # they take over ingesting from a process that has exited
+    global ingest_lock, ingest
+    seen = data.total
+    next_try = time.time() + ingest_retry
+    while True:
+        time.sleep(0.05)
+        if push_mode and data.total != seen:
+            seen = data.total
+            time_stamp, current = data.last()
+            broadcast(time_stamp, current)
+        if time.time() < next_try:
+            continue
+        next_try = time.time() + ingest_retry
+        lock = acquire_ingest_lock()
+        if lock is not None:
+            print("taking over ingesting MQTT messages")
+            with start_lock:
+                ingest_lock = lock
+                ingest = True
+                start_ingest()
+            return
+
 ###############################################################################
 # set up MQTT connection to AWS
 host = "a2z2lg09mryugj-ats.iot.us-east-1.amazonaws.com"
@@ -46,45 +245,192 @@ rootCAPath = "root-CA.crt"
 certificatePath = "Sensor_2.cert.pem"
 privateKeyPath = "Sensor_2.private.key"
 clientId = "sdk-java"
-topic = "sdk/test/Python"
+topic = "sensors/+/readings"
 
 # Port defaults
 #port = 443
 port = 8883
 
-# Init AWSIoTMQTTClient
+# AWS IOT client, set up by start()
 myAWSIoTMQTTClient = None
-myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId)
-myAWSIoTMQTTClient.configureEndpoint(host, port)
-myAWSIoTMQTTClient.configureCredentials(rootCAPath, privateKeyPath, certificatePath)
-
-# AWSIoTMQTTClient connection configuration
-myAWSIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
-myAWSIoTMQTTClient.configureOfflinePublishQueueing(-1)
-myAWSIoTMQTTClient.configureDrainingFrequency(2)
-myAWSIoTMQTTClient.configureConnectDisconnectTimeout(10)
-myAWSIoTMQTTClient.configureMQTTOperationTimeout(5)
-
-# Connect and subscribe to AWS IoT
-myAWSIoTMQTTClient.connect()
-myAWSIoTMQTTClient.subscribe(topic, 1, customCallback)
-time.sleep(2)
 
 # Sibscribe to AWS topic
 #loopCount = 0
 #myAWSIoTMQTTClient.subscribe(topic, 1, customCallback)
 
+###############################################################################
+# start up
+# importing this file doesn't open anything, so gunicorn can import it once
+# (--preload) and fork workers in milliseconds. each process calls start()
+# on its first request: the buffers are set up straight away, then the
+# history is reloaded from disk while AWS IoT connects, and once both are
+# done the MQTT topic is subscribed. /ready reports when everything is up
+
+started = None          # process id start() last ran in
+start_lock = threading.Lock()
+ready = {"history": threading.Event(), "mqtt": threading.Event()}
+
+def setup_mqtt():
+    # Init AWSIoTMQTTClient
+    global myAWSIoTMQTTClient
+    myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId)
+    myAWSIoTMQTTClient.configureEndpoint(host, port)
+    myAWSIoTMQTTClient.configureCredentials(rootCAPath, privateKeyPath, certificatePath)
+
+    # AWSIoTMQTTClient connection configuration
+    myAWSIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
+    myAWSIoTMQTTClient.configureOfflinePublishQueueing(-1)
+    myAWSIoTMQTTClient.configureDrainingFrequency(2)
+    myAWSIoTMQTTClient.configureConnectDisconnectTimeout(10)
+    myAWSIoTMQTTClient.configureMQTTOperationTimeout(5)
+    return
+
+def load_history():
+    # reload the last 2 days into the ring buffer and the rollups from disk
+    # so restarts don't lose the graphs
+    now = datetime.now()
+    data.clear()
+    data.extend(*store.read(now - timedelta(seconds=history_capacity), now))
+    for rollup in rollups:
+        rollup.data.clear()
+        rollup.load(now)
+    ready["history"].set()
+    return
+
+def connect_mqtt():
+    # connect to AWS IoT (retrying while there's no network) and subscribe
+    # once the history has been reloaded, so new readings aren't lost in it
+    delay = 1
+    while True:
+        try:
+            myAWSIoTMQTTClient.connect()
+            break
+        except Exception as e:
+            print("MQTT connect failed:", e)
+            time.sleep(delay)
+            delay = min(delay * 2, 32)
+    ready["history"].wait()
+    myAWSIoTMQTTClient.subscribe(topic, 1, customCallback)
+    ready["mqtt"].set()
+    return
+
+def start_ingest():
+    # this process holds the ingest lock, reload the history and connect
+    # to AWS IoT. devices get new rows in the fleet table as they publish
+    ready["history"].clear()
+    ready["mqtt"].clear()
+    fleet.clear()
+    setup_mqtt()
+    threading.Thread(target=load_history, daemon=True).start()
+    threading.Thread(target=connect_mqtt, daemon=True).start()
+    return
+
+def start():
+    """
+    set up the buffers and start reloading history and connecting to AWS
+    IoT in the background. does nothing if already started in this process
+    (a process forked after starting starts again)
+    """
+    global started, ingest_lock, ingest, data, store, rollups, fleet
+    with start_lock:
+        if started == os.getpid():
+            return
+        started = os.getpid()
+        os.makedirs(history_dir, exist_ok=True)
+        ingest_lock = acquire_ingest_lock()
+        ingest = ingest_lock is not None
+        data = RingBuffer(channels, history_capacity, shared("data"))
+        store = SegmentStore(history_dir, channels)
+        rollups = [Rollup(channels, 60, 60 * 24 * 60, os.path.join(history_dir, "1min"),
+                          shared("1min")),
+                   Rollup(channels, 3600, 2 * 365 * 24, os.path.join(history_dir, "1hour"),
+                          shared("1hour"))]
+        fleet = Fleet(channels, shared("fleet"), history=fleet_history)
+        if ingest:
+            start_ingest()
+        else:
+            # the ingesting process fills the shared memory
+            ready["history"].set()
+            ready["mqtt"].set()
+            threading.Thread(target=watch_shared, daemon=True).start()
+    return
+
 ###############################################################################
 # set up dashboard
 external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
 
 #app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.CYBORG])
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.CYBORG],
+                suppress_callback_exceptions=True)
 #app.scripts.config.serve_locally = True
 application = app.server
 
-app.layout = html.Div([
+@application.before_request
+def start_on_first_request():
+    start()
+    return
+
+@application.route("/metrics")
+def metrics():
+    # timing histograms in Prometheus text format (for this process only
+    # when running several workers)
+    text = registry.render()
+    for name, value in [("hits", responses.hits), ("misses", responses.misses)]:
+        text += "# TYPE dashboard_cache_%s_total counter\n" % name
+        text += "dashboard_cache_%s_total %d\n" % (name, value)
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+@application.route("/ready")
+def readiness():
+    # 200 once the history is loaded and MQTT is subscribed, 503 until then
+    status = {name: event.is_set() for name, event in ready.items()}
+    status["ingest"] = ingest
+    code = 200 if all(event.is_set() for event in ready.values()) else 503
+    return Response(json.dumps(status), status=code, mimetype="application/json")
+
+def push_supported(environ):
+    # True if the server handles requests concurrently (wsgi.multithread is
+    # set by threaded servers and gunicorn's gthread and async workers)
+    return push_mode and bool(environ.get("wsgi.multithread"))
+
+@application.route("/stream")
+def stream():
+    # server-sent events stream of new readings for push mode
+    if not push_supported(request.environ):
+        return Response("push mode needs a threaded or async worker", status=503,
+                        mimetype="text/plain")
+
+    def events():
+        subscriber = queue.Queue(maxsize=100)
+        latency = registry.histogram("dashboard_push_latency_seconds",
+                                     "time from a reading being taken to it being pushed to a browser")
+        with subscribers_lock:
+            subscribers.add(subscriber)
+        try:
+            while True:
+                try:
+                    time_ms, message = subscriber.get(timeout=15)
+                except queue.Empty:
+                    # comment line keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+                    continue
+                yield "data: %s\n\n" % message
+                # time_ms is local time (like the ring buffer), not epoch
+                now_ms = int(np.datetime64(datetime.now(), "ms").astype(np.int64))
+                latency.observe(max(0.0, (now_ms - time_ms) / 1000))
+        finally:
+            with subscribers_lock:
+                subscribers.discard(subscriber)
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def dashboard_layout(push):
+    # built on each visit, polling rather than pushing when 'push' is False
+    return html.Div([
         html.H1("Environment Dashboard"),
+        dcc.Link("Fleet overview", href="/fleet"),
+        html.Span(" | "),
+        dcc.Link("History", href="/history"),
         html.H3("Sensor Readings"),
 
         #html.Div(id="live-update-text"),
@@ -163,116 +509,449 @@ app.layout = html.Div([
 
         #html.H3("Graphs"),
 
+        dcc.Dropdown(
+            id="graph-window",
+            options=[{"label": "Last {} seconds".format(data_range), "value": data_range},
+                     {"label": "Last hour", "value": 60 * 60},
+                     {"label": "Last day", "value": 24 * 60 * 60},
+                     {"label": "Last week", "value": 7 * 24 * 60 * 60},
+                     {"label": "Last 30 days", "value": 30 * 24 * 60 * 60}],
+            value=data_range,
+            clearable=False,
+            style={"width": "200px", "color": "black"}
+        ),
+
         dcc.Graph(id="live-update-graph"),
+        dcc.Store(id="graph-state"),
+        dcc.Store(id="live-reading"),
+        dcc.Store(id="push-url", data="/stream" if push else None),
 
         dcc.Interval(
             id="interval-component",
-            interval=1*2000, # in milliseconds
+            interval=resync_interval if push else 1*2000, # in milliseconds
             n_intervals=0
         )
     ])
 
+fleet_layout = html.Div([
+        html.H1("Fleet Overview"),
+        dcc.Link("Environment dashboard", href="/"),
+        html.Div(id="fleet-table"),
+        dcc.Interval(
+            id="fleet-interval",
+            interval=1*5000, # in milliseconds
+            n_intervals=0
+        )
+    ])
+
+def history_layout():
+    # built on each visit so the dates default to the week up to today
+    today = datetime.now().date()
+    return html.Div([
+        html.H1("History"),
+        dcc.Link("Environment dashboard", href="/"),
+        html.Div([
+            dcc.DatePickerRange(
+                id="history-range",
+                display_format="YYYY-MM-DD",
+                start_date=today - timedelta(days=7),
+                end_date=today
+            ),
+            dcc.Dropdown(
+                id="history-channel",
+                options=[{"label": channel, "value": channel} for channel in channels],
+                value="Temperature",
+                clearable=False,
+                style={"width": "250px", "color": "black"}
+            )
+        ], className="row"),
+        dcc.Graph(id="history-graph")
+    ])
+
+# pages are chosen by url, validation_layout lets dash check the callbacks
+# for both pages up front
+app.layout = html.Div([
+        dcc.Location(id="url", refresh=False),
+        html.Div(id="page-content")
+    ])
+app.validation_layout = html.Div([app.layout, dashboard_layout(push_mode), fleet_layout,
+                                  history_layout()])
+
+@app.callback(Output('page-content', 'children'), Input('url', 'pathname'))
+@timed("dashboard_display_page_seconds", "time to render a page layout")
+def display_page(pathname):
+    if pathname == "/fleet":
+        return fleet_layout
+    if pathname == "/history":
+        return history_layout()
+    return dashboard_layout(push_supported(request.environ))
+
 ###############################################################################
-# dash callbacks and functions for each of the gauges, charts and information
+# functions for each of the gauges, charts and information
 
-@app.callback(Output('my-gauge-1', 'value'), Input('interval-component', 'n_intervals'))
-def temperature_gauge(value):
+def temperature_gauge(readings):
     # return temperature reading from AWS MQTT Subscription
     value = readings[0]
     return value
 
-@app.callback(Output('my-gauge-2', 'value'), Input('interval-component', 'n_intervals'))
-def pressure_gauge(value):
+def pressure_gauge(readings):
     # return pressure reading from AWS MQTT Subscription
     value = readings[1]
     return value
 
-@app.callback(Output('my-gauge-3', 'value'), Input('interval-component', 'n_intervals'))
-def humidity_gauge(value):
+def humidity_gauge(readings):
     # return humidity reading from AWS MQTT Subscription
     value = readings[2]
     return value
 
-@app.callback(Output('my-gauge-4', 'value'), Input('interval-component', 'n_intervals'))
-def gas_gauge(value):
+def gas_gauge(readings):
     # return gas reading from AWS MQTT Subscription
     value = readings[3]/1000
     return value
 
-@app.callback(Output('my-gauge-5', 'value'), Input('interval-component', 'n_intervals'))
-def air_quality(value):
+def air_quality(readings):
     # return air quality reading from AWS MQTT Subscription
     value = readings[4]
     return value
 
 ###############################################################################
 # callbacks and functions for creating the graphs
-@app.callback(Output('live-update-graph', 'figure'),
-              Input('interval-component', 'n_intervals'))
-def temperature_graph(n):
-    # temperature graph over time
-    global data, temp
-    time = datetime.now()
-    temp = int(readings[0])
-    humi = int(readings[2])
-    gas = int(readings[3]/1000)
-    airq = int(readings[4])
-    data["Time"].append(time)
-    data["Temperature"].append(temp)
-    data["Humidity"].append(humi)
-    data["Gas"].append(gas)
-    data["AirQ"].append(airq)
-
-    if len(data["Time"]) > data_range:
-        data["Time"].pop(0)
-        data["Temperature"].pop(0)
-        data["Humidity"].pop(0)
-        data["Gas"].pop(0)
-        data['AirQ'].pop(0)
+
+# channel, trace name and divisor for each of the 4 graphs (gas is in k ohms)
+graph_traces = [("Temperature", "T", 1),
+                ("AirQ", "AQ", 1),
+                ("Humidity", "Hu", 1),
+                ("Gas", "Gs", 1000)]
+
+def window_source(window):
+    """
+    return the ring buffer and (min, max, mean) column suffixes for the
+    finest resolution (1 second, 1 minute, 1 hour) that covers 'window'
+    seconds without scanning more than max_rows rows
+    """
+    if window <= history_capacity and window <= max_rows:
+        return data, ("", "", "")
+    for rollup in rollups:
+        if window <= rollup.resolution * rollup.data.capacity \
+                and window <= rollup.resolution * max_rows:
+            break
+    return rollup.data, ("_min", "_max", "_mean")
+
+def graph_series(channel, window, method="minmax", since=None, until=None):
+    """
+    return the (x, y) points to plot for one channel over the last 'window'
+    seconds (or only those after 'since' and up to 'until'), downsampled to
+    graph_points using min/max buckets or LTTB
+    """
+    buffer, suffixes = window_source(window)
+    if since is None:
+        since = np.datetime64(datetime.now(), "ms") - np.timedelta64(window, "s")
+    x, (low, high, mean) = buffer.read([channel + suffix for suffix in suffixes],
+                                       since, until)
+    if method == "lttb":
+        chosen = lttb(x, mean, graph_points)
+        return x[chosen], mean[chosen]
+    chosen, y = min_max(low, high, graph_points // 2)
+    return x[chosen], y
+
+def build_figure(window, until=None):
+    # build the full 4 graph figure for the last 'window' seconds
     fig = plotly.tools.make_subplots(rows=1, cols=4, vertical_spacing=0.2, shared_yaxes=True,
-                                     subplot_titles=("Temp {}'c".format(temp), "AirQ {}%".format(airq),
-                                     "Humidity {}%".format(humi), "Gas {} k ohms".format(gas)))
+                                     subplot_titles=("Temp 'c", "AirQ %",
+                                     "Humidity %", "Gas k ohms"))
     fig['layout']['legend'] = {'x': 0, 'y': 1, 'xanchor': 'left'}
-    fig['layout']['width'] = 1600
+    fig['layout']['width'] = graph_width
     fig['layout']['height'] = 400
     fig["layout"]["template"] = "plotly_dark"
     fig.update_layout(yaxis_range=[0,100])
-    
-    fig.append_trace({
-        'x': data['Time'],
-        'y': data['Temperature'],
-        'name': 'T',
-        'mode': 'lines',
-        'type': 'scatter'
-    }, 1, 1)
-    
-    fig.append_trace({
-        'x': data['Time'],
-        'y': data['AirQ'],
-        'name': 'AQ',
-        'mode': 'lines',
-        'type': 'scatter'
-    }, 1, 2)
 
-    fig.update_layout(yaxis_range=[0,100])
-    fig.append_trace({
-        'x': data['Time'],
-        'y': data['Humidity'],
-        'name': 'Hu',
-        'mode': 'lines',
-        'type': 'scatter'
-    }, 1, 3)
-
-    fig.append_trace({
-        'x': data['Time'],
-        'y': data['Gas'],
-        'name': 'Gs',
-        'mode': 'lines',
-        'type': 'scatter'
-    }, 1, 4)
+    for col, (channel, name, divisor) in enumerate(graph_traces, start=1):
+        x, y = graph_series(channel, window, until=until)
+        fig.append_trace({
+            'x': x,
+            'y': y / divisor,
+            'name': name,
+            'mode': 'lines',
+            'type': 'scatter'
+        }, 1, col)
+    return fig
+
+def graph_extend(window, since, until):
+    # new points for each graph after 'since', in the form extendData takes,
+    # or None if there aren't any
+    xs = []
+    ys = []
+    for channel, name, divisor in graph_traces:
+        x, y = graph_series(channel, window, since=since, until=until)
+        xs.append(x)
+        ys.append(y / divisor)
+    if len(xs[0]) == 0:
+        return None
+    return [{'x': xs, 'y': ys}, list(range(len(graph_traces))), window]
+
+def temperature_graph(window, state, until, version):
+    """
+    graphs of readings over time, up to the 'until' timestamp
+    the full figure is only built on page load or when the window changes.
+    short windows (drawn from 1 second readings without downsampling) are
+    then kept up to date by sending just the new points via extendData,
+    longer windows are rebuilt once a pixel's worth of time has passed.
+    figures and updates are cached by data 'version', so browsers showing
+    the same window share them
+    """
+    now = datetime.now()
+    now_ms = int(np.datetime64(now, "ms").astype(np.int64))
+    # a pixel's worth of time, the most often a long window needs redrawing
+    pixel_ms = window * 1000 / graph_points
+    source = window_source(window)[0]
+    if state is not None and state["window"] == window:
+        if state["live"]:
+            key = ("extend", window, state["last"], version)
+            extend = responses.get(key, lambda: graph_extend(
+                window, np.datetime64(state["last"], "ms"), until))
+            if extend is None:
+                return [dash.no_update, dash.no_update, dash.no_update]
+            state = dict(state, last=int(extend[0]['x'][0][-1].astype(np.int64)))
+            return [dash.no_update, extend, state]
+        if now_ms - state["built"] < pixel_ms:
+            return [dash.no_update, dash.no_update, dash.no_update]
+
+    if source is data:
+        # drawn from every reading, so it only changes with a new one
+        key = ("figure", window, version)
+    else:
+        # a rollup only changes when a bucket closes, or a pixel's worth of
+        # time moves the window along
+        key = ("figure", window, source.total, int(now_ms // pixel_ms))
+    fig = responses.get(key, lambda: build_figure(window, until).to_dict())
+    last = now_ms
+    if until is not None:
+        last = int(np.datetime64(until, "ms").astype(np.int64))
+    state = {"window": window,
+             "live": window <= graph_points and source is data,
+             "built": now_ms,
+             "last": last}
+    return [fig, dash.no_update, state]
+
+###############################################################################
+# single dash callback updating all of the gauges and the graph each tick
+# last_shown is the time of the latest reading it has sent to a browser
+
+last_shown = None
+
+@app.callback([Output('my-gauge-1', 'value'),
+               Output('my-gauge-2', 'value'),
+               Output('my-gauge-3', 'value'),
+               Output('my-gauge-4', 'value'),
+               Output('my-gauge-5', 'value'),
+               Output('live-update-graph', 'figure'),
+               Output('live-update-graph', 'extendData'),
+               Output('graph-state', 'data')],
+              [Input('interval-component', 'n_intervals'),
+               Input('graph-window', 'value')],
+              [State('graph-state', 'data')])
+@timed("dashboard_update_seconds", "time to update the gauges and graph")
+def update_dashboard(n, window, state):
+    # take one snapshot of the latest MQTT message so the gauges and graph
+    # all show the same reading, and update them in one request per tick
+    global last_shown
+    version = data.total
+    time_stamp, current = data.last()
+    if time_stamp is not None and time_stamp != last_shown:
+        # first time this reading has been shown, how long it took to get here
+        last_shown = time_stamp
+        age = (np.datetime64(datetime.now(), "ms") - time_stamp) / np.timedelta64(1, "s")
+        registry.histogram("dashboard_display_latency_seconds",
+                           "time from a reading being taken to it being shown on the dashboard"
+                           ).observe(max(0.0, age))
+    gauges = responses.get(("gauges", version), lambda: [temperature_gauge(current),
+                                                          pressure_gauge(current),
+                                                          humidity_gauge(current),
+                                                          gas_gauge(current),
+                                                          air_quality(current)])
+    return gauges + temperature_graph(window, state, time_stamp, version)
 
+###############################################################################
+# history queries, aggregates over any period served from the 1 minute and
+# 1 hour rollups rather than the 1 second readings
+
+def query_history(start, end, columns, bucket=None, quantiles=()):
+    """
+    min, max, mean (and quantiles of the rollup means, 0 - 1) of each of
+    'columns' between start and end (datetimes) in buckets of 'bucket'
+    seconds, by default about graph_points buckets. uses the finest rollup
+    that needs fewer than max_rows rows, the bucket is rounded to a
+    multiple of its resolution
+    returns (bucket seconds, rollup resolution, bucket start times,
+    {column: {stat: values}})
+    """
+    span = (end - start).total_seconds()
+    for rollup in rollups:
+        if span / rollup.resolution <= max_rows:
+            break
+    resolution = rollup.resolution
+    if bucket is None:
+        bucket = span / graph_points
+    bucket = max(1, int(round(bucket / resolution))) * resolution
+    width = np.timedelta64(bucket, "s")
+    # buckets line up with whole multiples of their width
+    first = np.datetime64(start, "ms")
+    first -= (first - np.datetime64(0, "ms")) % width
+    names = [column + suffix for column in columns for suffix in ("_min", "_max", "_mean")]
+    times, values = rollup.read(first.astype(datetime), end, names)
+    results = {}
+    for i, column in enumerate(columns):
+        low, high, mean = values[3 * i:3 * i + 3]
+        bucket_times, stats = bucket_stats(times, low, high, mean, first, width, quantiles)
+        results[column] = stats
+    return bucket, resolution, bucket_times, results
+
+@application.route("/api/history")
+def history_api():
+    """
+    GET /api/history?start=2026-01-01T00:00&end=2026-02-01&channels=Temperature,Gas
+                     &bucket=3600&stats=min,max,mean,p50,p95
+    start and end are ISO 8601 times, local unless they give a UTC offset
+    (default the last day), channels defaults to all of them, bucket
+    (seconds) to about graph_points buckets and stats to min,max,mean.
+    percentiles (pNN) are of the rollup means. the returned bucket start
+    times are local wall clock milliseconds (like the graphs), not epoch
+    """
+    args = request.args
+    try:
+        end = parse_time(args["end"]) if "end" in args else datetime.now()
+        start = parse_time(args["start"]) if "start" in args \
+            else end - timedelta(days=1)
+        bucket = float(args["bucket"]) if "bucket" in args else None
+    except ValueError as e:
+        return error_response(str(e))
+    if bucket is not None and not np.isfinite(bucket):
+        return error_response("bucket must be a number of seconds")
+    columns = args.get("channels", ",".join(channels)).split(",")
+    wanted = args.get("stats", "min,max,mean").split(",")
+    unknown = [column for column in columns if column not in channels]
+    if unknown:
+        return error_response("unknown channels: " + ",".join(unknown))
+    if end <= start or (bucket is not None and bucket <= 0):
+        return error_response("end must be after start and bucket positive")
+    # percentiles are looked up by the name bucket_stats gives them
+    quantiles = []
+    keys = {}
+    for stat in wanted:
+        keys[stat] = stat
+        if stat in ("min", "max", "mean"):
+            continue
+        try:
+            q = float(stat[1:]) / 100 if stat.startswith("p") else -1
+        except ValueError:
+            q = -1
+        if not 0 <= q <= 1:
+            return error_response("unknown stat: " + stat)
+        quantiles.append(q)
+        keys[stat] = "p%g" % (q * 100)
+    bucket, resolution, times, results = query_history(start, end, columns, bucket, quantiles)
+    body = {"start": start.isoformat(),
+            "end": end.isoformat(),
+            "bucket": bucket,
+            "resolution": resolution,
+            "time": times.astype(np.int64).tolist(),
+            "channels": {column: {stat: results[column][keys[stat]].tolist() for stat in wanted}
+                         for column in columns}}
+    return Response(json.dumps(body), mimetype="application/json")
+
+def parse_time(text):
+    # ISO 8601 time as a naive local datetime, converting one with a UTC
+    # offset to local time
+    time_stamp = datetime.fromisoformat(text)
+    if time_stamp.tzinfo is not None:
+        time_stamp = time_stamp.astimezone().replace(tzinfo=None)
+    return time_stamp
+
+def error_response(message):
+    return Response(json.dumps({"error": message}), status=400, mimetype="application/json")
+
+@app.callback(Output('history-graph', 'figure'),
+              [Input('history-range', 'start_date'),
+               Input('history-range', 'end_date'),
+               Input('history-channel', 'value')])
+@timed("dashboard_history_graph_seconds", "time to draw the history graph")
+def history_graph(start_date, end_date, channel):
+    # mean of the chosen channel with a band from its min to its max, the
+    # end date is included
+    start = datetime.fromisoformat(start_date[:10])
+    end = datetime.fromisoformat(end_date[:10]) + timedelta(days=1)
+    bucket, resolution, times, results = query_history(start, end, [channel])
+    stats = results[channel]
+    fig = plotly.graph_objs.Figure()
+    fig.add_trace({'x': times, 'y': stats["max"], 'name': "max", 'mode': 'lines',
+                   'line': {'width': 0}, 'type': 'scatter'})
+    fig.add_trace({'x': times, 'y': stats["min"], 'name': "min", 'mode': 'lines',
+                   'line': {'width': 0}, 'fill': 'tonexty', 'type': 'scatter'})
+    fig.add_trace({'x': times, 'y': stats["mean"], 'name': "mean", 'mode': 'lines',
+                   'type': 'scatter'})
+    fig['layout']['width'] = graph_width
+    fig['layout']['height'] = 400
+    fig["layout"]["template"] = "plotly_dark"
+    fig["layout"]["title"] = "%s (%s buckets)" % (channel, timedelta(seconds=bucket))
     return fig
 
+###############################################################################
+# fleet overview table, one row per device
+
+# header, channel index, divisor and decimal places for each reading column
+fleet_columns = [("Temp 'c", 0, 1, 1),
+                 ("Pressure mb", 1, 1, 0),
+                 ("Humidity %", 2, 1, 1),
+                 ("Gas k ohms", 3, 1000, 0),
+                 ("AirQ %", 4, 1, 1),
+                 ("Smoke", 5, 1, 0)]
+
+def fleet_value(value, divisor, places):
+    # a reading rounded for the fleet table, "–" if it's missing (NaN)
+    if value != value:
+        return "–"
+    return "%.*f" % (places, value / divisor)
+
+@app.callback(Output('fleet-table', 'children'), Input('fleet-interval', 'n_intervals'))
+@timed("dashboard_fleet_table_seconds", "time to render the fleet table")
+def fleet_table(n):
+    now = datetime.now()
+    # each reading is shown with its range over the device's recent readings
+    header = ["Device", "Last seen (s)"] + [name for name, _, _, _ in fleet_columns] \
+        + ["Messages"]
+    rows = [html.Tr([html.Th(name) for name in header])]
+    for device_id, time_stamp, readings, count, low, high in fleet.overview():
+        age = round((now - time_stamp).total_seconds()) if time_stamp else ""
+        cells = [html.Td(device_id), html.Td(age)]
+        for name, channel, divisor, places in fleet_columns:
+            latest, lowest, highest = [fleet_value(values[channel], divisor, places)
+                                       for values in (readings, low, high)]
+            cells.append(html.Td([latest, html.Br(),
+                                  html.Small("%s – %s" % (lowest, highest))]))
+        cells.append(html.Td(count))
+        rows.append(html.Tr(cells))
+    return html.Table(rows, className="table table-sm table-dark")
+
+# push mode: assets/dashboard.js opens the event stream and updates the
+# gauges and extends the graph in the browser as each reading arrives
+app.clientside_callback(
+    ClientsideFunction(namespace="dashboard", function_name="connect"),
+    Output('live-reading', 'data'),
+    Input('push-url', 'data'))
+
+app.clientside_callback(
+    ClientsideFunction(namespace="dashboard", function_name="update"),
+    [Output('my-gauge-1', 'value', allow_duplicate=True),
+     Output('my-gauge-2', 'value', allow_duplicate=True),
+     Output('my-gauge-3', 'value', allow_duplicate=True),
+     Output('my-gauge-4', 'value', allow_duplicate=True),
+     Output('my-gauge-5', 'value', allow_duplicate=True),
+     Output('live-update-graph', 'extendData', allow_duplicate=True),
+     Output('graph-state', 'data', allow_duplicate=True)],
+    Input('live-reading', 'data'),
+    State('graph-state', 'data'),
+    prevent_initial_call=True)
+
 
 if __name__ == '__main__':
     application.run(debug=True, port=8080)
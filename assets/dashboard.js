@@ -0,0 +1,39 @@
+// clientside callbacks for the Environment Dashboard push mode
+// readings arrive as {"time": epoch ms, "readings": [temp, pres, humi, gas, airq, smoke]}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    dashboard: {
+        connect: function(url) {
+            // open the server-sent events stream once per page
+            if (url && !window.dashboardStream) {
+                window.dashboardStream = new EventSource(url);
+                window.dashboardStream.onmessage = function(event) {
+                    window.dash_clientside.set_props("live-reading", {data: JSON.parse(event.data)});
+                };
+            }
+            return window.dash_clientside.no_update;
+        },
+
+        update: function(reading, state) {
+            var no_update = window.dash_clientside.no_update;
+            if (!reading) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            var r = reading.readings;
+            var gauges = [r[0], r[1], r[2], r[3] / 1000, r[4]];
+            // only short windows drawn from 1 second readings are extended,
+            // longer ones are redrawn by the server on the resync interval
+            if (!state || !state.live || reading.time <= state.last) {
+                return gauges.concat([no_update, no_update]);
+            }
+            // same trace order as graph_traces in application.py
+            // times are the server's wall clock, so format them without a
+            // timezone to match the x values the server draws
+            var t = new Date(reading.time).toISOString().slice(0, 23);
+            var extend = [{x: [[t], [t], [t], [t]],
+                           y: [[r[0]], [r[4]], [r[2]], [r[3] / 1000]]},
+                          [0, 1, 2, 3], state.window];
+            return gauges.concat([extend, Object.assign({}, state, {last: reading.time})]);
+        }
+    }
+});
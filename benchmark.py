@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the Environment Sensor, run on any computer using the
+simulated hardware and MQTT broker in simulation.py
+
+    python benchmark.py                      sensor loop at 1, 2, 5 and 10 Hz
+    python benchmark.py --rates 1 20 --seconds 60
+    python benchmark.py --i2c-latency 0.002 --i2c-fault-rate 0.001
+    python benchmark.py --dashboard          also time the dashboard callback
+
+For each sample rate the sensor program's main loop is run for a while in
+its own process and reports...
+    achieved sample period and how late samples start (jitter)
+    deadlines missed (overruns)
+    I2C transfers per sample
+    publish latency, from a reading being taken to its batch reaching the
+    broker (mostly the batching delay, see batch_seconds)
+The dashboard benchmark fills the history with simulated readings and
+times update_dashboard for a full redraw and an incremental update of each
+graph window.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import simulation
+
+# =====================================================================
+### Helper functions #########################
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+def ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+def run_child(args, mode, extra):
+    # run one benchmark in a fresh process, so every run starts from a
+    # newly imported program, and return its json result
+    command = [sys.executable, os.path.abspath(__file__), mode] + extra
+    command += ["--i2c-latency", str(args.i2c_latency),
+                "--i2c-fault-rate", str(args.i2c_fault_rate),
+                "--mqtt-latency", str(args.mqtt_latency),
+                "--mqtt-fault-rate", str(args.mqtt_fault_rate)]
+    output = subprocess.run(command, capture_output=True, text=True)
+    lines = output.stdout.strip().splitlines()
+    if output.returncode != 0 or not lines:
+        return {"error": output.stderr.strip().splitlines()[-1:] or ["no output"]}
+    return json.loads(lines[-1])
+
+def install(args):
+    simulation.install(i2c_latency=args.i2c_latency, i2c_fault_rate=args.i2c_fault_rate,
+                       mqtt_latency=args.mqtt_latency, mqtt_fault_rate=args.mqtt_fault_rate,
+                       connect_latency=0)
+    return
+
+# =====================================================================
+### Sensor loop benchmark ####################
+
+def device(args):
+    # runs in the child process, see run_child
+    install(args)
+    os.environ["SENSOR_DIR"] = tempfile.mkdtemp(prefix="sensor-")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main_project_v02 as program
+    from codec import decode_batch
+
+    schedulers = []
+    sample_times = []
+
+    class TimedScheduler(program.Scheduler):
+        # the real scheduler, stopping after the benchmark has run and
+        # noting when each sample was taken
+        def add(self, name, period, function, delay=0):
+            if name == "sample":
+                def timed(function=function):
+                    sample_times.append(self.clock())
+                    function()
+                return super().add(name, period, timed, delay)
+            return super().add(name, period, function, delay)
+
+        def run(self):
+            schedulers.append(self)
+            end = self.clock() + args.seconds
+            while self.clock() < end:
+                self.run_once()
+
+    program.Scheduler = TimedScheduler
+    program.sample_period = 1 / args.rate
+    program.display_period = 1 / args.rate
+    # set the boards up first so only the main loop's transfers are counted
+    with contextlib.redirect_stdout(io.StringIO()):
+        program.start()
+    calls = simulation.bus.calls
+    error = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            program.main()
+        except Exception as e:
+            error = "%s: %s" % (type(e).__name__, e)
+    calls = simulation.bus.calls - calls
+
+    latencies = []
+    sizes = []
+    for published, topic, payload in simulation.broker.published:
+        if topic == program.topic and payload[:1] != b"{":
+            sizes.append(len(payload))
+            latencies += [published - t for t, readings in decode_batch(payload)]
+    stats = schedulers[0].stats()["sample"] if schedulers else {}
+    period = None
+    if len(sample_times) > 1:
+        period = ms((sample_times[-1] - sample_times[0]) / (len(sample_times) - 1))
+    runs = stats.get("runs", 0)
+    return {"rate": args.rate,
+            "samples": runs,
+            "period_ms": period,
+            "jitter_mean_ms": stats.get("mean_ms"),
+            "jitter_stdev_ms": stats.get("stdev_ms"),
+            "jitter_max_ms": stats.get("max_ms"),
+            "overruns": stats.get("overruns"),
+            "i2c_per_sample": round(calls / runs, 1) if runs else None,
+            "i2c_faults": simulation.bus.faults,
+            "messages": len(sizes),
+            "bytes_per_message": round(sum(sizes) / len(sizes)) if sizes else None,
+            "publish_latency_mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+            "publish_latency_p95_ms": ms(percentile(latencies, 95)),
+            "error": error}
+
+# =====================================================================
+### Dashboard benchmark ######################
+
+def dashboard(args):
+    # runs in the child process, see run_child
+    install(args)
+    os.environ["HISTORY_DIR"] = tempfile.mkdtemp(prefix="history-")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with contextlib.redirect_stdout(io.StringIO()):
+        import application
+        application.start()
+        application.ready["history"].wait()
+        # fill the history with a reading a second
+        start = datetime.now() - timedelta(seconds=args.readings)
+        for i in range(args.readings):
+            readings = [21 + i % 50 / 10, 1013, 40, 80000, 90, 60]
+            application.record_reading(application.home_device,
+                                       start + timedelta(seconds=i), readings)
+    results = {"readings": args.readings}
+    for window in [application.data_range, 3600, 86400, 7 * 86400, 30 * 86400]:
+        full = []
+        update = []
+        for _ in range(args.repeats):
+            begin = perf_counter()
+            outputs = application.update_dashboard(0, window, None)
+            full.append(perf_counter() - begin)
+            state = outputs[-1]
+            with contextlib.redirect_stdout(io.StringIO()):
+                application.record_reading(application.home_device, datetime.now(),
+                                           [22, 1013, 40, 80000, 90, 60])
+            begin = perf_counter()
+            application.update_dashboard(1, window, state)
+            update.append(perf_counter() - begin)
+        results[str(window)] = {"full_ms": ms(percentile(full, 50)),
+                                "update_ms": ms(percentile(update, 50))}
+    return results
+
+# =====================================================================
+### Main function ############################
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rates", type=float, nargs="+", default=[1, 2, 5, 10],
+                        help="sample rates (Hz) to run the sensor loop at")
+    parser.add_argument("--seconds", type=float, default=30,
+                        help="how long to run the sensor loop at each rate")
+    parser.add_argument("--dashboard", action="store_true",
+                        help="also benchmark the dashboard callback")
+    parser.add_argument("--readings", type=int, default=2 * 24 * 60 * 60,
+                        help="readings to fill the dashboard history with")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--i2c-latency", type=float, default=0.0005,
+                        help="seconds per simulated I2C transfer")
+    parser.add_argument("--i2c-fault-rate", type=float, default=0.0,
+                        help="probability of an I2C transfer failing")
+    parser.add_argument("--mqtt-latency", type=float, default=0.02,
+                        help="seconds per simulated MQTT publish")
+    parser.add_argument("--mqtt-fault-rate", type=float, default=0.0,
+                        help="probability of an MQTT publish failing")
+    parser.add_argument("--device", dest="mode", action="store_const", const="device",
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--dashboard-only", dest="mode", action="store_const",
+                        const="dashboard", help=argparse.SUPPRESS)
+    parser.add_argument("--rate", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode == "device":
+        print(json.dumps(device(args)))
+        return
+    if args.mode == "dashboard":
+        print(json.dumps(dashboard(args)))
+        return
+
+    for rate in args.rates:
+        result = run_child(args, "--device", ["--rate", str(rate), "--seconds", str(args.seconds)])
+        print(json.dumps(result))
+    if args.dashboard:
+        result = run_child(args, "--dashboard-only",
+                           ["--readings", str(args.readings), "--repeats", str(args.repeats)])
+        print(json.dumps(result))
+    return
+
+if __name__ == '__main__':
+    main()
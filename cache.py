@@ -0,0 +1,64 @@
+"""
+Bounded least-recently-used cache for the dashboard
+
+Callback results are cached under a key that includes the data version
+(the ring buffer's reading count), so every browser asking for the same
+thing between two readings shares one computed result. When several ask
+for a missing entry at once only the first computes it, the others wait
+for its result.
+"""
+
+import threading
+from collections import OrderedDict
+
+# =====================================================================
+### LRU cache class ##########################
+
+class LRUCache:
+    """
+    holds at most maxsize entries, dropping the least recently used
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.pending = {}           # key -> Event set when it is computed
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        """
+        return the cached value for key, calling compute() to make it if
+        it isn't cached (or being computed by another thread)
+        """
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key]
+                waiting = self.pending.get(key)
+                if waiting is None:
+                    self.pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # another thread is computing it, wait then look again (it may
+            # have failed, in which case this thread tries)
+            waiting.wait()
+        try:
+            value = compute()
+            with self.lock:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+            return value
+        finally:
+            with self.lock:
+                self.pending.pop(key).set()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        return
@@ -0,0 +1,109 @@
+"""
+Compact binary encoding for batches of sensor readings
+
+Used by the sensor to publish several readings in one MQTT message and by
+the dashboard to decode them. Pure python so it runs on the Raspberry Pi
+without any extra libraries.
+
+Message layout (all integers are varints, signed ones zigzag encoded)
+    version byte (1)
+    number of channels
+    decimal places kept for each channel (one byte each)
+    number of readings
+    time of first reading (epoch milliseconds, signed)
+    for each reading:
+        milliseconds since the previous reading (signed, in case the
+        clock is stepped back)
+        change in each channel since the previous reading (signed,
+        scaled to whole numbers using the channel's decimal places)
+"""
+
+VERSION = 1
+
+# decimal places kept for temperature, pressure, humidity, gas, air quality
+# and smoke (the order the sensor publishes readings in)
+DECIMALS = [2, 2, 2, 0, 1, 0]
+
+# =====================================================================
+### Varint functions ########################
+
+def _put_varint(out, value):
+    # unsigned LEB128: 7 bits per byte, high bit set on all but the last
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return
+
+def _put_signed(out, value):
+    # zigzag encoding so small negative numbers stay small
+    _put_varint(out, -2 * value - 1 if value < 0 else 2 * value)
+    return
+
+def _get_varint(payload, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = payload[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def _get_signed(payload, pos):
+    value, pos = _get_varint(payload, pos)
+    return (value >> 1) ^ -(value & 1), pos
+
+# =====================================================================
+### Batch functions #########################
+
+def encode_batch(batch, decimals=DECIMALS):
+    """
+    encode a list of (epoch seconds, readings) into bytes
+    every readings list must have the same number of channels
+    """
+    channels = len(batch[0][1])
+    decimals = (list(decimals) + [0] * channels)[:channels]
+    scales = [10 ** d for d in decimals]
+    out = bytearray([VERSION])
+    _put_varint(out, channels)
+    out += bytes(decimals)
+    _put_varint(out, len(batch))
+    previous_time = int(round(batch[0][0] * 1000))
+    _put_signed(out, previous_time)
+    previous = [0] * channels
+    for time_stamp, readings in batch:
+        ms = int(round(time_stamp * 1000))
+        _put_signed(out, ms - previous_time)
+        previous_time = ms
+        for i in range(channels):
+            value = int(round(readings[i] * scales[i]))
+            _put_signed(out, value - previous[i])
+            previous[i] = value
+    return bytes(out)
+
+def decode_batch(payload):
+    """
+    decode bytes from encode_batch back into a list of
+    (epoch seconds, readings)
+    """
+    if payload[0] != VERSION:
+        raise ValueError("unknown batch version %d" % payload[0])
+    channels, pos = _get_varint(payload, 1)
+    decimals = list(payload[pos:pos + channels])
+    pos += channels
+    scales = [10 ** d for d in decimals]
+    count, pos = _get_varint(payload, pos)
+    ms, pos = _get_signed(payload, pos)
+    values = [0] * channels
+    batch = []
+    for _ in range(count):
+        delta, pos = _get_signed(payload, pos)
+        ms += delta
+        for i in range(channels):
+            change, pos = _get_signed(payload, pos)
+            values[i] += change
+        readings = [v / s if s > 1 else v for v, s in zip(values, scales)]
+        batch.append((ms / 1000, readings))
+    return batch
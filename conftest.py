@@ -0,0 +1,23 @@
+# lets the tests in tests/ import the modules in this directory
+
+import sys
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def simulated():
+    """
+    simulation.py's hardware and AWS stand-ins installed in sys.modules for
+    one test module. sys.modules is put back afterwards, dropping anything
+    imported against the stand-ins (e.g. main_project_v02), so other tests
+    never run against them
+    """
+    import simulation
+    saved = dict(sys.modules)
+    simulation.install()
+    yield simulation
+    for name in list(sys.modules):
+        if name not in saved:
+            del sys.modules[name]
+    sys.modules.update(saved)
@@ -0,0 +1,133 @@
+"""
+Per-device state for a fleet of Environment Sensors
+
+Each sensor publishes to its own MQTT topic (sensors/<client id>/readings)
+and the dashboard keeps the latest reading and the last few readings of
+every device it has heard from, for the fleet page.
+"""
+
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from history import open_shared
+
+###############################################################################
+# state for a single sensor device
+
+class Device:
+    """
+    latest reading and recent history for one device, kept in the device's
+    row of the fleet table so they can be read from other worker processes.
+    the history is a ring of the last 'history' readings
+    """
+
+    def __init__(self, device_id, table, row):
+        self.device_id = device_id
+        self.table = table
+        self.row = row
+        self.count = 0
+
+    def record(self, time_stamp, readings):
+        # only ever called from the MQTT thread, so no locking is needed
+        self.count += 1
+        if self.row is None:
+            return
+        # odd sequence number while the row is being written (seqlock)
+        table = self.table
+        table["seq"][self.row] += 1
+        table["time"][self.row] = np.datetime64(time_stamp, "ms").astype(np.int64)
+        table["readings"][self.row] = readings[:table["readings"].shape[1]]
+        recent = table["recent"][self.row]
+        recent[(self.count - 1) % len(recent)] = table["readings"][self.row]
+        table["count"][self.row] = self.count
+        table["seq"][self.row] += 1
+        return
+
+
+###############################################################################
+# all of the devices seen so far, keyed by client id
+
+class Fleet:
+    """
+    dictionary of Device objects keyed by client id, plus a fixed-size
+    table of every device's latest reading and its last 'history' readings
+
+    the dictionary is replaced rather than modified when a new device joins,
+    so the MQTT thread and dash workers can look devices up and iterate over
+    them without locking. the lock is only taken the first time a device is
+    seen. if a shared memory name is given the table is shared, so worker
+    processes that don't receive MQTT messages can still show the overview
+    """
+
+    def __init__(self, channels, name=None, max_devices=1024, history=60):
+        self.channels = list(channels)
+        self.devices = {}
+        self.lock = threading.Lock()
+        self.dtype = np.dtype([("seq", "<i8"), ("time", "<i8"), ("count", "<i8"),
+                               ("id", "S64"), ("readings", "<f8", (len(self.channels),)),
+                               ("recent", "<f8", (history, len(self.channels)))])
+        size = 8 + self.dtype.itemsize * max_devices
+        self.shm = None
+        if name is None:
+            buffer = bytearray(size)
+        else:
+            self.shm = open_shared(name, size)
+            if self.shm.size < size:
+                raise ValueError("shared memory %s is too small for the fleet" % name)
+            buffer = self.shm.buf
+        # rows[0] = number of rows in use
+        self.rows = np.ndarray(1, dtype=np.int64, buffer=buffer)
+        self.table = np.ndarray(max_devices, dtype=self.dtype, buffer=buffer, offset=8)
+
+    def clear(self):
+        self.rows[0] = 0
+        return
+
+    def device(self, device_id):
+        # return the Device for device_id, creating it on first use
+        device = self.devices.get(device_id)
+        if device is None:
+            with self.lock:
+                device = self.devices.get(device_id)
+                if device is None:
+                    row = int(self.rows[0])
+                    if row < len(self.table):
+                        self.table[row] = (0, 0, 0, device_id.encode()[:64], 0, 0)
+                        self.rows[0] = row + 1
+                    else:
+                        print("fleet table full, not showing", device_id)
+                        row = None
+                    device = Device(device_id, self.table, row)
+                    devices = dict(self.devices)
+                    devices[device_id] = device
+                    self.devices = devices
+        return device
+
+    def record(self, device_id, time_stamp, readings):
+        self.device(device_id).record(time_stamp, readings)
+        return
+
+    def overview(self):
+        # list of (device id, time of last reading, readings, message count,
+        # lowest and highest of each channel over the recent readings) read
+        # from the table, retrying any row that is being written. missing
+        # readings are NaN
+        rows = []
+        for row in range(int(self.rows[0])):
+            while True:
+                seq = int(self.table["seq"][row])
+                entry = self.table[row].copy()
+                if seq % 2 == 0 and seq == int(self.table["seq"][row]):
+                    break
+            time_stamp = None
+            if entry["count"] > 0:
+                time_stamp = np.datetime64(int(entry["time"]), "ms").astype(datetime)
+            # fmin / fmax skip missing readings
+            recent = entry["recent"][:min(int(entry["count"]), len(entry["recent"]))]
+            low = np.fmin.reduce(recent, axis=0, initial=np.nan).tolist()
+            high = np.fmax.reduce(recent, axis=0, initial=np.nan).tolist()
+            rows.append((entry["id"].decode(), time_stamp, entry["readings"].tolist(),
+                         int(entry["count"]), low, high))
+        return sorted(rows)
@@ -0,0 +1,154 @@
+"""
+Self-calibrating BME680 gas baseline for the Environment Sensor
+
+The BME680's gas resistance isn't an absolute measure, it varies from sensor
+to sensor, falls with humidity and drifts as the sensor ages. Rather than
+comparing readings with a fixed 50 kohm ceiling, the baseline (the
+resistance of clean air for this sensor) is learnt from the readings
+themselves, and air quality is scored against it.
+
+Readings are humidity compensated and tracked as logs, so the baseline is a
+running estimate of a high quantile of log resistance: clean air gives the
+highest resistance, so most readings should sit below it. The estimate
+moves a small step up or down for each reading (stochastic quantile
+estimation) which needs no memory of past readings and a few floating point
+operations per sample. The state is saved to a small json file so the
+baseline survives restarts.
+"""
+
+import json
+import os
+from math import exp, log
+from time import time
+
+# =====================================================================
+### Gas baseline class #######################
+
+class GasBaseline:
+    """
+    tracks the clean air gas resistance and scores air quality against it
+
+    quantile      proportion of humidity compensated readings expected to
+                  be below the baseline
+    step          how far (in log resistance) the baseline can move per
+                  reading once settled, about 0.1 an hour at 1 reading a
+                  second, so a few days of dirty air won't drag it down
+    humidity_slope  change in log resistance per % humidity, readings are
+                  compensated to what they would be at target_hum
+    warmup        seconds after start up that the baseline doesn't learn from
+                  gas readings while the heater plate settles. readings are
+                  still scored against a baseline restored from path
+    fallback      function(humidity, gas) giving the air quality before
+                  there is a baseline to score against (e.g. the fixed 50
+                  kohm calc_air_quality), or None to score on humidity alone
+    path          json file the state is saved to by save(), or None
+    """
+
+    def __init__(self, path=None, quantile=0.9, step=0.00003, humidity_slope=0.03,
+                 target_hum=40, warmup=300, fallback=None, clock=time):
+        self.path = path
+        self.quantile = quantile
+        self.step = step
+        self.humidity_slope = humidity_slope
+        self.target_hum = target_hum
+        self.warmup = warmup
+        self.fallback = fallback
+        self.clock = clock
+        self.started = clock()
+        self.baseline = None      # log of the clean air resistance (ohms)
+        self.count = 0            # readings the baseline has learnt from
+        self.air_quality = None   # last score, held while gas is unavailable
+        if path is not None:
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+                self.baseline = state["baseline"]
+                self.count = state["count"]
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def compensate(self, humidity, gas):
+        # log gas resistance corrected to target_hum humidity
+        return log(gas) + self.humidity_slope * (humidity - self.target_hum)
+
+    def update(self, humidity, gas):
+        """
+        add a reading to the baseline, gas of 0 (heater not stable) and
+        readings during warm up are ignored
+        returns the humidity compensated log resistance, or None if ignored
+        """
+        if gas <= 0 or self.clock() - self.started < self.warmup:
+            return None
+        value = self.compensate(humidity, gas)
+        self.count += 1
+        if self.baseline is None:
+            self.baseline = value
+        else:
+            # large steps while there are few readings so a new sensor
+            # settles within minutes, then the small fixed step
+            step = max(self.step, 1 / self.count)
+            if value < self.baseline:
+                self.baseline -= step * (1 - self.quantile)
+            else:
+                self.baseline += step * self.quantile
+        return value
+
+    def gas_score(self, humidity, gas):
+        # ratio of compensated resistance to the baseline (0 - 1), or None
+        value = self.update(humidity, gas)
+        if value is None and gas > 0 and self.baseline is not None:
+            # warming up with a baseline restored from the last run, score
+            # against it without learning from the reading
+            value = self.compensate(humidity, gas)
+        if value is None or self.baseline is None:
+            return None
+        return min(1.0, exp(value - self.baseline))
+
+    def humidity_score(self, humidity):
+        # humidity's part of the air quality (0 - 25), highest at target_hum
+        target_hum = self.target_hum
+        hum_diff = abs(target_hum - humidity)
+        hum_percent = 25
+        if humidity < target_hum:
+            hum_percent = 25 - (hum_diff / target_hum * 25)
+        if humidity > target_hum:
+            hum_percent = 25 - (hum_diff / (100 - target_hum) * 25)
+        return hum_percent
+
+    def score(self, humidity, gas):
+        """
+        air quality (0 - 99.9) where humidity contributes 25% as in
+        calc_air_quality and gas 75%, scaled by how close the reading is to
+        the baseline. until there is a baseline (the first warm up of a new
+        sensor) the fallback score is used, and while there is no usable gas
+        reading the last score is repeated. if there is no last score (the
+        first reading after a start) the fallback is used, or the humidity
+        part alone without one, so a number is always returned
+        """
+        gas_score = self.gas_score(humidity, gas)
+        if gas_score is None:
+            if self.air_quality is None or (self.baseline is None and gas > 0):
+                if self.fallback is not None:
+                    self.air_quality = self.fallback(humidity, gas)
+                else:
+                    self.air_quality = round(self.humidity_score(humidity), 1)
+            return self.air_quality
+        hum_percent = self.humidity_score(humidity)
+        self.air_quality = min(round(hum_percent + gas_score * 75, 1), 99.9)
+        return self.air_quality
+
+    def resistance(self):
+        # clean air resistance (ohms) at target_hum, or None if not known yet
+        if self.baseline is None:
+            return None
+        return exp(self.baseline)
+
+    def save(self):
+        # write the state to path, via a temporary file so a power cut
+        # can't leave half a file
+        if self.path is None or self.baseline is None:
+            return
+        with open(self.path + ".tmp", "w") as f:
+            json.dump({"baseline": self.baseline, "count": self.count}, f)
+        os.replace(self.path + ".tmp", self.path)
+        return
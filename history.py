@@ -0,0 +1,510 @@
+"""
+Sensor history storage for the Environment Dashboard
+
+Keeps a fixed amount of recent sensor readings in memory so the dashboard
+graphs can be drawn without the history growing (or slowing down) forever,
+and an append-only copy of every reading on disk so history survives
+restarts.
+"""
+
+import json
+import os
+from multiprocessing import resource_tracker, shared_memory
+from datetime import datetime, timedelta
+
+import numpy as np
+
+###############################################################################
+# named shared memory segments, used when running several worker processes
+
+def open_shared(name, size):
+    """
+    create the shared memory segment 'name' of at least size bytes, or
+    attach to it if another process already has
+
+    python's resource tracker unlinks every segment a process opened when
+    that process exits, so a recycled worker would take the segment with it
+    and the next worker would create a new, empty one. segments are taken
+    out of the tracker here and only removed by unlink_shared()
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+def unlink_shared(name):
+    # remove a segment made by open_shared, once no process needs it
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+    return
+
+###############################################################################
+# fixed-capacity ring buffer of timestamped sensor readings
+
+class RingBuffer:
+    """
+    columnar ring buffer holding one shared timestamp column and one column
+    per sensor channel
+
+    every row is written twice, at position i and i + slots, so the most
+    recent rows are always one contiguous slice of the underlying arrays.
+    this means appending is O(1) and reading back the history in time order
+    returns numpy views rather than copies
+
+    there is a single writer (the MQTT thread) and any number of readers,
+    which may be in other processes if a shared memory name is given. the
+    writer announces how many rows it is about to write in state[1], writes
+    them, then publishes the new total in state[0]. readers use read() or
+    last(), which copy the rows they need and start again if the writer
+    wrapped round into them while copying. one spare slot is kept so the
+    row being written is never one of the rows readers can see
+    """
+
+    def __init__(self, channels, capacity, name=None):
+        self.channels = list(channels)
+        self.capacity = int(capacity)
+        self.slots = self.capacity + 1
+        self.index = {channel: i for i, channel in enumerate(self.channels)}
+        size = 8 * (2 + 2 * self.slots * (1 + len(self.channels)))
+        self.shm = None
+        if name is None:
+            buffer = bytearray(size)
+        else:
+            self.shm = open_shared(name, size)
+            if self.shm.size < size:
+                raise ValueError("shared memory %s is too small for this buffer" % name)
+            buffer = self.shm.buf
+        # state[0] = rows written in total, state[1] = rows being written
+        self.state = np.ndarray(2, dtype=np.int64, buffer=buffer)
+        self.time = np.ndarray(2 * self.slots, dtype="datetime64[ms]", buffer=buffer, offset=16)
+        self.values = np.ndarray((len(self.channels), 2 * self.slots), dtype=np.float64,
+                                 buffer=buffer, offset=16 + 16 * self.slots)
+
+    @property
+    def total(self):
+        # number of rows appended since the buffer was created or cleared
+        return int(self.state[0])
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def clear(self):
+        self.state[:] = 0
+        return
+
+    def append(self, time_stamp, readings):
+        """
+        add one row of readings, overwriting the oldest row when full
+        readings is either a dict keyed by channel name or a sequence in
+        the same order as self.channels
+        """
+        if isinstance(readings, dict):
+            row = [readings.get(name, np.nan) for name in self.channels]
+        else:
+            row = readings
+        stamp = np.datetime64(time_stamp, "ms")
+        self.extend(np.array([stamp]), np.array(row, dtype=np.float64).reshape(-1, 1))
+        return
+
+    def extend(self, times, values):
+        """
+        add a block of rows in one go (used to reload history at start up)
+        times is a 1d array of timestamps, values is a 2d array with one row
+        per channel and one column per timestamp
+        """
+        times = np.asarray(times, dtype="datetime64[ms]")[-self.capacity:]
+        values = np.asarray(values, dtype=np.float64)[:, -self.capacity:]
+        total = self.total
+        done = 0
+        while done < len(times):
+            # write as many rows as fit before wrapping round to the start
+            pos = total % self.slots
+            count = min(len(times) - done, self.slots - pos)
+            self.state[1] = total + count
+            for offset in (pos, pos + self.slots):
+                self.time[offset:offset + count] = times[done:done + count]
+                self.values[:, offset:offset + count] = values[:, done:done + count]
+            total += count
+            self.state[0] = total
+            done += count
+        return
+
+    def _window(self, count=None):
+        # start / stop positions and total for the newest 'count' rows
+        total = self.total
+        size = min(total, self.capacity)
+        if count is not None:
+            size = min(size, count)
+        stop = (total - 1) % self.slots + 1 if total else 0
+        if stop < size:
+            stop += self.slots
+        return stop - size, stop, total
+
+    def _intact(self, first, start, total):
+        # True if the row at position 'first' (window starting at 'start'
+        # holding rows up to 'total') was not overwritten while reading
+        oldest = total - min(total, self.capacity) + (first - start)
+        return oldest >= int(self.state[1]) - self.slots
+
+    def times(self, count=None):
+        # timestamps of the newest 'count' rows, oldest first (numpy view,
+        # only safe to use from the writer's thread)
+        start, stop, total = self._window(count)
+        return self.time[start:stop]
+
+    def column(self, name, count=None):
+        # readings for one channel, oldest first (numpy view, only safe to
+        # use from the writer's thread)
+        start, stop, total = self._window(count)
+        return self.values[self.index[name], start:stop]
+
+    def read(self, columns, since=None, until=None):
+        """
+        return a consistent copy of (times, [values for each column]) for
+        the rows with since < time <= until, safe to call while another
+        thread or process is appending
+        """
+        rows = [self.index[name] for name in columns]
+        while True:
+            start, stop, total = self._window()
+            times = self.time[start:stop]
+            first, last = start, stop
+            if since is not None:
+                first = start + int(np.searchsorted(times, np.datetime64(since, "ms"), side="right"))
+            if until is not None:
+                last = start + int(np.searchsorted(times, np.datetime64(until, "ms"), side="right"))
+            last = max(first, last)
+            copy_times = self.time[first:last].copy()
+            copy_values = self.values[rows, first:last]
+            if self._intact(first, start, total):
+                return copy_times, list(copy_values)
+
+    def first(self):
+        # timestamp of the oldest row held, or None if nothing has been
+        # recorded yet
+        while True:
+            start, stop, total = self._window()
+            if total == 0:
+                return None
+            stamp = self.time[start]
+            if self._intact(start, start, total):
+                return stamp
+
+    def last(self):
+        # most recent timestamp and row of readings (in channel order), or
+        # (None, zeros) if nothing has been recorded yet
+        while True:
+            start, stop, total = self._window(1)
+            if total == 0:
+                return None, [0.0] * len(self.channels)
+            stamp = self.time[start]
+            row = self.values[:, start].tolist()
+            if self._intact(start, start, total):
+                return stamp, row
+
+###############################################################################
+# append-only on-disk store, one binary segment file per day
+
+class SegmentStore:
+    """
+    stores every reading as a fixed-size binary record (epoch milliseconds
+    followed by one float64 per channel) appended to a file for that day,
+    e.g. history/2022-04-09.bin
+
+    range queries memory-map the day files, so reading back a month of
+    history only pages in the parts of the files that are actually used
+    """
+
+    def __init__(self, directory, channels):
+        self.directory = directory
+        self.channels = list(channels)
+        self.index = {name: i for i, name in enumerate(self.channels)}
+        self.dtype = np.dtype([("time", "<i8")] + [(name, "<f8") for name in self.channels])
+        self.day = None
+        self.file = None
+        os.makedirs(directory, exist_ok=True)
+        # record the channel layout so old files are never misread
+        schema_path = os.path.join(directory, "schema.json")
+        if os.path.exists(schema_path):
+            with open(schema_path) as f:
+                if json.load(f)["channels"] != self.channels:
+                    raise ValueError("history in %s has different channels" % directory)
+        else:
+            with open(schema_path, "w") as f:
+                json.dump({"channels": self.channels}, f)
+
+    def _path(self, day):
+        return os.path.join(self.directory, day.strftime("%Y-%m-%d") + ".bin")
+
+    def append(self, time_stamp, readings):
+        """
+        append one row of readings, starting a new segment file at midnight
+        readings is either a dict keyed by channel name or a sequence in
+        the same order as self.channels
+        """
+        if isinstance(readings, dict):
+            readings = [readings.get(name, np.nan) for name in self.channels]
+        if time_stamp.date() != self.day:
+            self.close()
+            self.day = time_stamp.date()
+            self.file = self._open(self.day)
+        record = np.zeros(1, dtype=self.dtype)
+        record["time"] = np.datetime64(time_stamp, "ms").astype(np.int64)
+        for name, value in zip(self.channels, readings):
+            record[name] = value
+        self.file.write(record.tobytes())
+        self.file.flush()
+        return
+
+    def _open(self, day):
+        # open a day file for appending, cutting off any partly written last
+        # record left by a power cut so the records after it line up
+        file = open(self._path(day), "ab")
+        size = file.seek(0, os.SEEK_END)
+        if size % self.dtype.itemsize:
+            file.truncate(size - size % self.dtype.itemsize)
+        return file
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        return
+
+    def _segment(self, day):
+        # memory map one day file, ignoring any partly written last record
+        path = self._path(day)
+        if not os.path.exists(path):
+            return None
+        count = os.path.getsize(path) // self.dtype.itemsize
+        if count == 0:
+            return None
+        return np.memmap(path, dtype=self.dtype, mode="r", shape=(count,))
+
+    def segments(self, start, stop):
+        """
+        yield the records between start and stop (datetimes) one day at a
+        time, as read-only views onto the memory-mapped files
+        """
+        start_ms = np.datetime64(start, "ms").astype(np.int64)
+        stop_ms = np.datetime64(stop, "ms").astype(np.int64)
+        day = start.date()
+        while day <= stop.date():
+            records = self._segment(day)
+            if records is not None:
+                first, last = np.searchsorted(records["time"], [start_ms, stop_ms], side="left")
+                if last > first:
+                    yield records[first:last]
+            day += timedelta(days=1)
+        return
+
+    def read(self, start, stop, channels=None):
+        """
+        return (times, values) for the records between start and stop, where
+        values has one row per requested channel
+        """
+        if channels is None:
+            channels = self.channels
+        blocks = list(self.segments(start, stop))
+        if not blocks:
+            return (np.zeros(0, dtype="datetime64[ms]"),
+                    np.zeros((len(channels), 0), dtype=np.float64))
+        times = np.concatenate([b["time"] for b in blocks]).astype("datetime64[ms]")
+        values = np.vstack([np.concatenate([b[name] for b in blocks]) for name in channels])
+        return times, values
+
+
+###############################################################################
+# rollups of readings at coarser resolutions (e.g. 1 minute and 1 hour)
+
+class Rollup:
+    """
+    aggregates readings into fixed-length time buckets, keeping the min, max
+    and mean of every channel for each bucket
+
+    closed buckets are kept in a RingBuffer (columns named e.g.
+    "Temperature_min", in shared memory if a name is given) and, if a
+    directory is given, appended to a SegmentStore there so they can be
+    reloaded quickly at start up
+    """
+
+    stats = ("min", "max", "mean")
+
+    def __init__(self, channels, resolution, capacity, directory=None, name=None):
+        self.channels = list(channels)
+        self.resolution = int(resolution)      # bucket length in seconds
+        self.columns = [channel + "_" + stat for channel in self.channels for stat in self.stats]
+        self.data = RingBuffer(self.columns, capacity, name)
+        self.store = None
+        if directory is not None:
+            self.store = SegmentStore(directory, self.columns)
+        self.bucket = None                      # start of the open bucket (ms)
+        self.count = 0
+        self.total = np.zeros(len(self.channels))
+        self.low = np.zeros(len(self.channels))
+        self.high = np.zeros(len(self.channels))
+
+    def add(self, time_stamp, readings, low=None, high=None, count=1):
+        """
+        add one row of readings (same order as self.channels), or a summary
+        of 'count' readings with their mean as readings and their lowest and
+        highest values as low and high (e.g. a rollup sent by a sensor)
+        """
+        row = np.asarray(readings, dtype=np.float64)
+        low = row if low is None else np.asarray(low, dtype=np.float64)
+        high = row if high is None else np.asarray(high, dtype=np.float64)
+        stamp = np.datetime64(time_stamp, "ms").astype(np.int64)
+        bucket = stamp - stamp % (self.resolution * 1000)
+        if bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+            self.count = 0
+            self.total[:] = 0
+            self.low[:] = np.inf
+            self.high[:] = -np.inf
+        self.count += count
+        self.total += row * count
+        np.minimum(self.low, low, out=self.low)
+        np.maximum(self.high, high, out=self.high)
+        return
+
+    def flush(self):
+        # close the open bucket and record its min / max / mean
+        if self.bucket is None or self.count == 0:
+            return
+        row = np.column_stack([self.low, self.high, self.total / self.count]).ravel()
+        time_stamp = np.datetime64(int(self.bucket), "ms")
+        self.data.append(time_stamp, row)
+        if self.store is not None:
+            self.store.append(time_stamp.astype(datetime), row)
+        self.count = 0
+        return
+
+    def load(self, stop):
+        # reload as many closed buckets as fit in memory from the store
+        if self.store is not None:
+            start = stop - timedelta(seconds=self.resolution * self.data.capacity)
+            self.data.extend(*self.store.read(start, stop))
+        return
+
+    def read(self, start, stop, columns):
+        """
+        return (times, [values for each column]) for the closed buckets
+        starting from start up to (not including) stop, from memory if it
+        goes back far enough, otherwise from the store
+        """
+        oldest = self.data.first()
+        start_ms = np.datetime64(start, "ms")
+        stop_ms = np.datetime64(stop, "ms")
+        one_ms = np.timedelta64(1, "ms")
+        if self.store is None or (oldest is not None and start_ms > oldest):
+            return self.data.read(columns, start_ms - one_ms, stop_ms - one_ms)
+        times, values = self.store.read(start, stop, columns)
+        return times, list(values)
+
+
+###############################################################################
+# aggregates of rollup rows over longer buckets, for the history query API
+
+def bucket_stats(times, low, high, mean, start, width, quantiles=()):
+    """
+    combine rollup rows into buckets of 'width' (timedelta64) from 'start'
+    (datetime64), giving the min of low, max of high and mean of mean for
+    each bucket, and quantiles (0 - 1) of the rows' means. only buckets
+    with rows are returned, as (bucket start times, {stat: values}) where
+    quantiles are named e.g. "p95"
+    """
+    if len(times) == 0:
+        stats = {"min": low, "max": high, "mean": mean}
+        for q in quantiles:
+            stats["p%g" % (q * 100)] = mean
+        return times, stats
+    index = (times - start) // width
+    # rows are in time order, so each bucket is a contiguous run of rows
+    firsts = np.flatnonzero(np.diff(index, prepend=-1))
+    counts = np.diff(np.append(firsts, len(index)))
+    stats = {}
+    stats["min"] = np.minimum.reduceat(low, firsts)
+    stats["max"] = np.maximum.reduceat(high, firsts)
+    stats["mean"] = np.add.reduceat(mean, firsts) / counts
+    if quantiles:
+        # sort the means within each bucket, then interpolate between the
+        # two values either side of each quantile's position
+        ordered = mean[np.lexsort((mean, index))]
+        for q in quantiles:
+            position = firsts + q * (counts - 1)
+            below = np.floor(position).astype(np.int64)
+            above = np.minimum(below + 1, firsts + counts - 1)
+            fraction = position - below
+            values = ordered[below] * (1 - fraction) + ordered[above] * fraction
+            stats["p%g" % (q * 100)] = values
+    bucket_times = start + index[firsts] * width
+    return bucket_times, stats
+
+
+###############################################################################
+# downsampling of long series to a fixed number of points for plotting
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling
+    returns the indices of the 'threshold' points that best preserve the
+    visual shape of the line y against x
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x).astype(np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    chosen = np.zeros(threshold, dtype=np.int64)
+    chosen[-1] = n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        # average of the next bucket (or the last point) is the third corner
+        if i + 2 < len(edges):
+            next_x = x[stop:edges[i + 2]].mean()
+            next_y = y[stop:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        chosen[i + 1] = previous
+    return chosen
+
+
+def min_max(low, high, buckets):
+    """
+    min/max downsampling
+    splits the series into 'buckets' equal groups and keeps the lowest (from
+    low) and highest (from high) point of each group in time order, so
+    spikes are never lost. for raw readings pass the same array as low and
+    high. returns (indices, values)
+    """
+    n = len(low)
+    if 2 * buckets >= n:
+        return np.arange(n), np.asarray(high)
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    lows = np.minimum.reduceat(low, edges[:-1])
+    highs = np.maximum.reduceat(high, edges[:-1])
+    indices = []
+    values = []
+    for i in range(buckets):
+        start, stop = edges[i], edges[i + 1]
+        a = start + int(np.argmax(low[start:stop] == lows[i]))
+        b = start + int(np.argmax(high[start:stop] == highs[i]))
+        if a <= b:
+            indices += [a, b]
+            values += [lows[i], highs[i]]
+        else:
+            indices += [b, a]
+            values += [highs[i], lows[i]]
+    return np.array(indices, dtype=np.int64), np.array(values)
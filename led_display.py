@@ -0,0 +1,63 @@
+"""
+Cached driver for the two LTP305 LED matrix breakouts
+
+The 4 character display is made from two LTP305 breakouts, each showing two
+characters. The breakouts are opened once and the last characters, decimal
+point and brightness sent to each are remembered, so nothing is written over
+the shared I2C bus unless it has changed.
+"""
+
+# =====================================================================
+### Display manager class ####################
+
+class DisplayManager:
+    """
+    left and right are LTP305 objects (addresses 99 and 97 on the sensor)
+    each breakout is the smallest unit the LTP305 library can update, so a
+    breakout is only redrawn when one of its two characters or its decimal
+    point changes
+    """
+
+    def __init__(self, left, right):
+        self.devices = [left, right]
+        self.shown = [None, None]   # (char, char, decimal) on each breakout
+        self.brightness = None
+        self.writes = 0             # number of updates sent over I2C
+
+    def draw(self, string, decimal=0):
+        """
+        displays string across the 2 led matrix displays
+        """
+        if len(string) > 4:
+            return
+        cells = [(string[0], string[1], 0), (string[2], string[3], decimal)]
+        for i, device in enumerate(self.devices):
+            if cells[i] == self.shown[i]:
+                continue
+            first, second, point = cells[i]
+            device.clear()
+            device.set_character(0, first)
+            device.set_character(5, second)
+            device.set_decimal(left=point)
+            device.show()
+            self.shown[i] = cells[i]
+            self.writes += 1
+        return
+
+    def set_brightness(self, level):
+        # brightness from 0 to 1, only sent if it has changed
+        if level == self.brightness:
+            return
+        for device in self.devices:
+            device.set_brightness(level, True)
+            self.writes += 1
+        self.brightness = level
+        return
+
+    def blank(self):
+        for device in self.devices:
+            device.clear()
+            device.show()
+            self.writes += 1
+        self.shown = [("", "", 0), ("", "", 0)]
+        return
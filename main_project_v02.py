@@ -14,20 +14,39 @@ v0.2    20/03/2022 Updated to include AWS IOT MQTT publishing code
 # =====================================================================
 # import libraries for controlling breakout boards
 from ltp305 import LTP305                   # lcd display library
+from led_display import DisplayManager      # cached driver for both displays
 from max30105 import MAX30105, HeartRate    # particle & heart rate sensor library
 from trackball import TrackBall             # trackball library
 import bme680                               # environment sensor library
 # import libraries for interfacing with AWS via MQTT Link
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
+from codec import encode_batch, DECIMALS    # compact binary batches of readings
+from aggregate import Aggregator            # per-minute min/max/mean/last rollups
+from alerts import Rule, AlertEngine        # alert rules with hysteresis
+from spool import Spool                     # on-disk store-and-forward spool
+from scheduler import Scheduler             # fixed rate task scheduler
+from trackball_input import TrackballInput  # interrupt driven trackball events
+from acquisition import Acquisition         # reads the sensors concurrently
+from gas_baseline import GasBaseline        # learns the clean air gas resistance
+from metrics import registry, timed         # timing histograms
 
 # import supporting libraries
 import json
-from time import sleep
+import queue
+import numpy as np
+from time import sleep, time, monotonic
 from datetime import datetime
 import os
 import sys
-# change directory to location of certificates and keys for AWS IOT
-os.chdir("/home/pi/Sensor2")
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# nothing below talks to the hardware or AWS when this file is imported,
+# start() (called by main) sets it all up. location of certificates and keys
+# for AWS IOT, start() changes to this directory (SENSOR_DIR overrides it,
+# e.g. when running with simulation.py)
+sensor_dir = os.environ.get("SENSOR_DIR", "/home/pi/Sensor2")
 
 # =====================================================================
 # set up AWS MQTT client
@@ -35,115 +54,258 @@ host = "a2z2lg09mryugj-ats.iot.us-east-1.amazonaws.com"
 rootCAPath = "root-CA.crt"
 certificatePath = "Sensor_2.cert.pem"
 privateKeyPath = "Sensor_2.private.key"
-clientId = "basicPubSub"
-topic = "sdk/test/Python"
+clientId = "basicPubSub"   # must be unique for each sensor in the fleet
+topic = "sensors/" + clientId + "/readings"
+alert_topic = "sensors/" + clientId + "/alerts"
+stats_topic = "sensors/" + clientId + "/stats"
 
 # flag used to determine whether to broadcast via MQTT to AWS IOT or not
 MQTT_broadcast = True                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                             
 
+# readings are published in batches, one message once batch_size readings
+# have been taken or the oldest is batch_seconds old
+batch_size = 10
+batch_seconds = 10
+
+# readings are handed to a background publisher thread through a bounded
+# queue so a slow network never holds up the sensor loop. when the queue is
+# full publish_policy decides what happens to the new reading...
+#   "drop_oldest" - discard the oldest queued reading
+#   "drop_newest" - discard the new reading
+#   "coalesce"    - replace the newest queued reading with the new one
+publish_queue_size = 600
+publish_policy = "drop_oldest"
+publish_queue = deque()
+publish_ready = threading.Condition()
+dropped_readings = 0
+
+# batches are written to a spool on the SD card (capped at spool_bytes)
+# and a drainer thread publishes them in order, at most drain_rate
+# messages a second, whenever the MQTT connection is up
+spool_dir = "spool"
+spool_bytes = 50 * 1000 * 1000
+drain_rate = 5
+mqtt_online = threading.Event()
+
+# publish_mode "raw" publishes every reading, "rollup" publishes one
+# summary (min, max, mean and last of each reading) every rollup_period
+# seconds. in either mode alerts (see alert_rules) are published straight
+# away on alert_topic, waiting in alert_queue while offline
+publish_mode = "raw"
+rollup_period = 60
+alert_queue = queue.Queue(maxsize=100)
+
+# timings of the main functions (see metrics.py), the scheduler's jitter
+# and the publish queue are published on stats_topic every stats_period
+# seconds, through alert_queue
+stats_period = 300
+
 # Port defaults
 port = 443
 port = 8883
 
-# Init AWSIoTMQTTClient
-if MQTT_broadcast == True:
-    myAWSIoTMQTTClient = None
-    myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId)
-    myAWSIoTMQTTClient.configureEndpoint(host, port)
-    myAWSIoTMQTTClient.configureCredentials(rootCAPath, privateKeyPath, certificatePath)
-
-# AWSIoTMQTTClient connection configuration
-    myAWSIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
-    myAWSIoTMQTTClient.configureOfflinePublishQueueing(-1)
-    myAWSIoTMQTTClient.configureDrainingFrequency(2) 
-    myAWSIoTMQTTClient.configureConnectDisconnectTimeout(10)
-    myAWSIoTMQTTClient.configureMQTTOperationTimeout(5)
-
-# Connect and subscribe to AWS IoT
-    myAWSIoTMQTTClient.connect()
-
+# AWS IOT client and spool, set up by start()
+myAWSIoTMQTTClient = None
+spool = None
 
 # =====================================================================
 # set up the breakout boards attached to the Raspberry Pi
-# initialise the lcd display
-display = LTP305(address=97)
-display.clear()
-display.show()
-
-# initialise trackball and set up colours for led light
-trackball = TrackBall(interrupt_pin=4)
-trackball.set_rgbw(0, 0, 0, 0)
+# the boards are set up by start(), ready holds an event for each that is
+# set once it has been set up (and for mqtt while connected)
+lcd = None
+trackball = None
+max30105 = None
+hr = None
+sensor = None
+ready = {"lcd": threading.Event(),
+         "trackball": threading.Event(),
+         "max30105": threading.Event(),
+         "bme680": threading.Event(),
+         "mqtt": mqtt_online}
+
 trackball_colours = [[0, 0, 0],         # off
                     [255, 0, 0],        # red
                     [0, 255, 0],        # green
                     [0, 0, 255],        # blue
                     [255, 150, 255]]    # purple
 
-# initialise particle detection sensor (heart rate sensor)
-max30105 = MAX30105()
-max30105.setup(leds_enable=3)
-max30105.set_led_pulse_amplitude(1, 0.0)
-max30105.set_led_pulse_amplitude(2, 0.0)
-max30105.set_led_pulse_amplitude(3, 12.5)
-max30105.set_slot_mode(1, 'red')
-max30105.set_slot_mode(2, 'ir')
-max30105.set_slot_mode(3, 'green')
-max30105.set_slot_mode(4, 'off')
-
-hr = HeartRate(max30105)
-
-# initialise bme688 environment sensor
-try:
-    sensor = bme680.BME680(bme680.I2C_ADDR_PRIMARY)
-except:
-    sensor = bme680.BME680(bme680.I2C_ADDR_SECONDARY)
-    
-sensor.set_humidity_oversample(bme680.OS_2X)
-sensor.set_pressure_oversample(bme680.OS_4X)
-sensor.set_temperature_oversample(bme680.OS_8X)
-sensor.set_filter(bme680.FILTER_SIZE_3)
-sensor.set_gas_status(bme680.ENABLE_GAS_MEAS)                          
-sensor.set_gas_heater_temperature(320)
-sensor.set_gas_heater_duration(150)
-sensor.select_gas_heater_profile(0)
+# in burst mode each particle sensor FIFO sample averages 32 conversions,
+# so the 32 sample FIFO holds 2.5 seconds and never overflows between reads
+max30105_burst = True
+
+# particle readings are filtered a FIFO block at a time in burst mode,
+# using the same low pass FIR filter as HeartRate.low_pass_fir (including its
+# gain, so readings stay on the same scale). fir_history holds the end of
+# the last block so the filter carries on smoothly into the next one
+fir_half = [172, 321, 579, 927, 1360, 1858, 2390, 2916, 3391, 3768, 4012]
+fir_taps = np.array(fir_half + [4096] + fir_half[::-1]) / 32768
+fir_history = np.zeros(len(fir_taps) - 1)
 
 # text to show on the led matrix display
 display_names = ["TIME", "TEMP", "PRES", "HUMI", "GAS ", "SMOK", "AirQ"]
 
-# lower / upper limits for warnings (light trackball led RED)
+# names of the readings, in the order they are taken and published
+channel_names = ["temperature", "pressure", "humidity", "gas", "airq", "smoke"]
+
+# alerts light the trackball led RED and are printed and published
 # values set for testing purposes only
-warnings = [[5, 25],          # temp
-            [980, 1300],      # pressure
-            [30, 50],         # humidity
-            [30000, 1000000],  # gas resistance
-            [80, 100],       # smoke
-            [50, 10000]]        # air quality
+# Rule(name, channel, low, high, hysteresis, duration (seconds), rate
+# (change per second), window (seconds the rate is measured over),
+# direction ("rising", "falling" or None for either))
+alert_rules = [Rule("temperature", "temperature", 5, 25, hysteresis=0.5, duration=30),
+               Rule("temperature rising", "temperature", rate=2 / 60, window=300,
+                    direction="rising"),
+               Rule("pressure", "pressure", 980, 1300, hysteresis=1, duration=60),
+               Rule("humidity", "humidity", 30, 50, hysteresis=1, duration=60),
+               Rule("gas", "gas", 30000, 1000000, hysteresis=2000, duration=60),
+               Rule("air quality", "airq", 80, 100, hysteresis=2, duration=60),
+               Rule("smoke", "smoke", 50, 10000, hysteresis=5, duration=10)]
+
+# each alert is notified at most once every alert_interval seconds
+alert_interval = 300
+
+# seconds between runs of each task in the main loop
+sample_period = 1.0
+display_period = 1.0
+brightness_period = 60
+report_period = 300
+baseline_period = 600
+
+# score air quality against a learnt clean air gas resistance rather than
+# a fixed 50 kohms, the baseline is saved to baseline_file every
+# baseline_period seconds and on exit
+gas_calibration = True
+baseline_file = "gas_baseline.json"
+gas_baseline = None
+
+# a button press held for long_press seconds is a long press
+long_press = 0.5
 
 # =====================================================================
-#### Trackball functions #####################
-def read_trackball():
+### Start up functions #######################
+
+def setup_mqtt():
+    # configure the AWS IOT client, connecting is left to connect_mqtt
+    global myAWSIoTMQTTClient
+    myAWSIoTMQTTClient = AWSIoTMQTTClient(clientId)
+    myAWSIoTMQTTClient.configureEndpoint(host, port)
+    myAWSIoTMQTTClient.configureCredentials(rootCAPath, privateKeyPath, certificatePath)
+
+    # AWSIoTMQTTClient connection configuration
+    myAWSIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
+    # offline messages are kept in the spool rather than the SDK's queue
+    myAWSIoTMQTTClient.configureOfflinePublishQueueing(0)
+    myAWSIoTMQTTClient.configureDrainingFrequency(2) 
+    myAWSIoTMQTTClient.configureConnectDisconnectTimeout(10)
+    myAWSIoTMQTTClient.configureMQTTOperationTimeout(5)
+
+    myAWSIoTMQTTClient.onOnline = mqtt_online.set
+    myAWSIoTMQTTClient.onOffline = mqtt_online.clear
+    return
+
+def connect_mqtt():
     """
-    read trackball sensor data
-    return "np" if not pressed
-    return "sp" if short press
-    return "lp" if long press
-    nb - currently only the button status is being read
+    background thread connecting to AWS IOT, retrying with a growing delay
+    if there's no network. the SDK reconnects by itself once connected, and
+    readings are spooled until then so the sensor loop doesn't wait
     """
-    tb_read = trackball.read()
-    button = tb_read[4]
-    state = tb_read[5]
-    if button > 0 and state == True:
-        sleep(0.5)
-        state = trackball.read()[5]
-        if state == False:
-            # short press
-            return "sp"
-        else:
-            # long press
-            return "lp"
-    # no press
-    return "np"
+    delay = 1
+    while True:
+        try:
+            myAWSIoTMQTTClient.connect()
+            return
+        except Exception as e:
+            print("MQTT connect failed:", e)
+            sleep(delay)
+            delay = min(delay * 2, 32)
+
+def setup_lcd():
+    # initialise the lcd displays (left-most at address 99, right-most at 97)
+    global lcd
+    lcd = DisplayManager(LTP305(address=99), LTP305(address=97))
+    lcd.blank()
+    return
+
+def setup_trackball():
+    # initialise trackball and turn off its led light
+    global trackball
+    trackball = TrackBall(interrupt_pin=4)
+    trackball.set_rgbw(0, 0, 0, 0)
+    return
+
+def setup_max30105():
+    # initialise particle detection sensor (heart rate sensor)
+    global max30105, hr
+    max30105 = MAX30105()
+    if max30105_burst == True:
+        max30105.setup(leds_enable=3, sample_average=32)
+    else:
+        max30105.setup(leds_enable=3)
+    max30105.set_led_pulse_amplitude(1, 0.0)
+    max30105.set_led_pulse_amplitude(2, 0.0)
+    max30105.set_led_pulse_amplitude(3, 12.5)
+    max30105.set_slot_mode(1, 'red')
+    max30105.set_slot_mode(2, 'ir')
+    max30105.set_slot_mode(3, 'green')
+    max30105.set_slot_mode(4, 'off')
+    hr = HeartRate(max30105)
+    return
+
+def setup_bme680():
+    # initialise bme688 environment sensor
+    global sensor
+    try:
+        sensor = bme680.BME680(bme680.I2C_ADDR_PRIMARY)
+    except:
+        sensor = bme680.BME680(bme680.I2C_ADDR_SECONDARY)
+        
+    sensor.set_humidity_oversample(bme680.OS_2X)
+    sensor.set_pressure_oversample(bme680.OS_4X)
+    sensor.set_temperature_oversample(bme680.OS_8X)
+    sensor.set_filter(bme680.FILTER_SIZE_3)
+    sensor.set_gas_status(bme680.ENABLE_GAS_MEAS)                          
+    sensor.set_gas_heater_temperature(320)
+    sensor.set_gas_heater_duration(150)
+    sensor.select_gas_heater_profile(0)
+    return
+
+def start():
+    """
+    set up everything the main loop needs. the boards are set up at the
+    same time (each I2C transfer is a single kernel call, so they can share
+    the bus) and AWS IOT connects in the background. does nothing if
+    already started
+    """
+    global spool, gas_baseline
+    if ready["bme680"].is_set():
+        return
+    os.chdir(sensor_dir)
+    if gas_calibration == True:
+        gas_baseline = GasBaseline(baseline_file, fallback=calc_air_quality)
+    if MQTT_broadcast == True:
+        spool = Spool(spool_dir, spool_bytes)
+        setup_mqtt()
+        threading.Thread(target=connect_mqtt, daemon=True).start()
+
+    def setup(name, function):
+        function()
+        ready[name].set()
+
+    boards = {"lcd": setup_lcd, "trackball": setup_trackball,
+              "max30105": setup_max30105, "bme680": setup_bme680}
+    with ThreadPoolExecutor(max_workers=len(boards)) as pool:
+        futures = [pool.submit(setup, name, function) for name, function in boards.items()]
+    for future in futures:
+        # raise the first error setting up a board
+        future.result()
+    return
 
+def readiness():
+    # which parts are set up (or for mqtt, connected)
+    return {name: event.is_set() for name, event in ready.items()}
+
+# =====================================================================
+#### Trackball functions #####################
 def light_trackball(colour):
     # illuminate trackball with a set colour, by name of colour
     r, g, b = trackball_colours[colour]
@@ -153,45 +315,27 @@ def light_trackball(colour):
 # =====================================================================
 ### LCD Display functions ####################
 
+@timed("sensor_draw_lcd_seconds", "time to update the led displays")
 def draw_lcd(string, decimal=0):
     """
-    displays string across the 2 led matrix displays
+    displays string across the 2 led matrix displays, only updating
+    the displays whose characters have changed
     """
-    if len(string) > 4:
-        return
-    # left-most display
-    display = LTP305(address=99)
-    display.clear()
-    display.set_character(0, string[0])
-    display.set_character(5, string[1])
-    display.show()
-    
-    # right-most display
-    display = LTP305(address=97)
-    display.clear()
-    display.set_character(0, string[2])
-    display.set_character(5, string[3])
-    display.set_decimal(left=decimal)
-    display.show()
+    lcd.draw(string, decimal)
     return
 
 def bright_lcd(level):
     if level == True:
-        display = LTP305(address=99)
-        display.set_brightness(1, True)
-        display = LTP305(address=97)
-        display.set_brightness(1, True)
+        lcd.set_brightness(1)
     else:
-        display = LTP305(address=99)
-        display.set_brightness(0.25, True)
-        display = LTP305(address=97)
-        display.set_brightness(0.25, True)
+        lcd.set_brightness(0.25)
     return
 
 # =====================================================================
 ### Read Environment Sensor functions ########
 
 # max30105 air particle (and heart rate) sensor
+@timed("sensor_read_max30105_seconds", "time to read the particle sensor")
 def read_max30105():
     samples = max30105.get_samples()
     reading = 0
@@ -203,7 +347,35 @@ def read_max30105():
         temp = max30105.get_temperature()
     return [reading, temp]    
 
+@timed("sensor_read_max30105_seconds", "time to read the particle sensor")
+def read_max30105_burst():
+    """
+    read every sample waiting in the max30105 FIFO in one go, median
+    filter them to remove single sample spikes, then low pass filter them
+    returns [mean particle reading, temperature, particle variance]
+    """
+    global fir_history
+    samples = max30105.get_samples()
+    reading = 0
+    temp = 0
+    variance = 0
+    if samples:
+        # samples are red, ir, green for each slot, particles use green
+        raw = np.asarray(samples).reshape(-1, 3)[:, 2] & 0xff
+        padded = np.concatenate([raw[:1], raw, raw[-1:]])
+        median = np.median(np.lib.stride_tricks.sliding_window_view(padded, 3), axis=1)
+        block = np.concatenate([fir_history, median])
+        smooth = np.convolve(block, fir_taps, mode="valid")
+        fir_history = block[-(len(fir_taps) - 1):]
+        # whole numbers like low_pass_fir, so the display formatting is the same
+        reading = int(smooth.mean())
+        variance = float(smooth.var())
+        sleep(0.05)
+        temp = max30105.get_temperature()
+    return [reading, temp, variance]
+
 # bme680 4-in-1 environmental sensor
+@timed("sensor_read_environment_seconds", "time to read the environment sensor")
 def read_environment():
     if sensor.get_sensor_data():
         raw_temp = sensor.data.temperature
@@ -234,6 +406,8 @@ def format_readings(sensor_readings):
     return [temp, pres, humi, gas, smoke]
 
 def calc_air_quality(humidity, gas):
+    # (air_quality.py has array versions of this and the format functions
+    # for reprocessing stored readings, keep them in step)
     # calculate air quality where...
     # ideal humidity is 40% and contributes 25% to overall air quality
     # calculate humidity %age (min = 0%, max = 25%)
@@ -263,61 +437,210 @@ def format_air(air_quality):
     air = str(air_quality).replace(".", "") + "%"
     return air
 
-def publish_readings(readings):
-    # publish readings to AWS IOT via MQTT connection
-    message = {}
-    message['time_stamp'] = datetime.now().strftime("%H:%M:%S")
-    message['readings'] = readings
-    messageJson = json.dumps(message)
-    myAWSIoTMQTTClient.publish(topic, messageJson, 1)
-    print('Published topic %s: %s\n' % (topic, messageJson))
+@timed("sensor_publish_readings_seconds", "time to queue a reading to publish")
+def publish_readings(readings, time_stamp=None):
+    # queue readings (taken at epoch time_stamp, default now) for the
+    # publisher thread, never blocks
+    global dropped_readings
+    if time_stamp is None:
+        time_stamp = time()
+    with publish_ready:
+        if len(publish_queue) >= publish_queue_size:
+            dropped_readings += 1
+            if publish_policy == "drop_newest":
+                return
+            elif publish_policy == "coalesce":
+                publish_queue.pop()
+            else:
+                publish_queue.popleft()
+        publish_queue.append((time_stamp, readings))
+        publish_ready.notify()
+    return
+
+def publisher():
+    """
+    background thread taking readings off the publish queue and writing
+    them to the spool in batches, once a batch is full or its oldest
+    reading is batch_seconds old
+    """
+    batch = []
+    while True:
+        with publish_ready:
+            if not publish_queue:
+                timeout = None
+                if batch:
+                    timeout = max(0, batch_seconds - (time() - batch[0][0]))
+                publish_ready.wait(timeout)
+            while publish_queue and len(batch) < batch_size:
+                batch.append(publish_queue.popleft())
+        if not batch:
+            continue
+        if len(batch) < batch_size and time() - batch[0][0] < batch_seconds:
+            continue
+        spool.append(encode_batch(batch))
+        batch = []
+
+def drainer():
+    """
+    background thread publishing spooled batches to AWS IOT via MQTT
+    connection in the order they were taken, waiting while offline
+    """
+    while True:
+        mqtt_online.wait()
+        message = spool.peek(timeout=batch_seconds)
+        if message is None:
+            continue
+        try:
+            start = monotonic()
+            myAWSIoTMQTTClient.publish(topic, message, 1)
+            registry.histogram("sensor_mqtt_publish_seconds",
+                               "time to publish a message").observe(monotonic() - start)
+        except Exception as e:
+            # leave the message in the spool and try again
+            print("publish failed:", e)
+            sleep(1)
+            continue
+        spool.advance()
+        print('Published topic %s: %d bytes (%d bytes spooled, %d readings dropped)\n'
+              % (topic, len(message), len(spool), dropped_readings))
+        # limit the rate when catching up after being offline
+        sleep(1 / drain_rate)
+
+def publish_rollup(rollup):
+    # rollups are spooled and published on the readings topic as JSON
+    spool.append(json.dumps({"rollup": rollup}).encode())
+    return
+
+def publish_alert(alert):
+    # queue an alert for the alerter thread, never blocks
+    try:
+        alert_queue.put_nowait((alert_topic, json.dumps(alert)))
+    except queue.Full:
+        print("alert dropped:", alert)
+    return
+
+def publish_stats(stats):
+    # queue a stats message for the alerter thread, never blocks
+    try:
+        alert_queue.put_nowait((stats_topic, json.dumps(stats)))
+    except queue.Full:
+        pass
+    return
+
+def alerter():
+    """
+    background thread publishing alerts (and stats) as soon as they are
+    raised, skipping the publish queue and spool so they aren't held up
+    behind readings
+    """
+    while True:
+        message_topic, message = alert_queue.get()
+        while True:
+            mqtt_online.wait()
+            try:
+                myAWSIoTMQTTClient.publish(message_topic, message, 1)
+                break
+            except Exception as e:
+                print("alert publish failed:", e)
+                sleep(1)
+        print('Published topic %s: %s\n' % (message_topic, message))
+
+def start_publisher():
+    for target in (publisher, drainer, alerter):
+        threading.Thread(target=target, daemon=True).start()
     return
 
 # =====================================================================
 ### Main function ############################
 
 def main():
+    """
+    runs each part of the program as a task at its own fixed rate using
+    a deadline scheduler (see scheduler.py), so the sample period doesn't
+    drift or change when the button is pressed
+    """
+    start()
+    # state shared between the tasks below
     display_index = 0
     tick = True
-    name = display_names[display_index]
-    decimal_point = 0
-    draw_lcd(name, 0)
-    sleep(1)
-    drawn = False
+    warning = 0
     time_of_day = "day"
-    while True:
-        date_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        for x in range(9):
-            read_tb = read_trackball()
+    formatted_readings = None
+    trackball_input = TrackballInput(trackball, 4, long_press=long_press)
+    if max30105_burst == True:
+        acquisition = Acquisition({"bme680": read_environment, "max30105": read_max30105_burst})
+    else:
+        acquisition = Acquisition({"bme680": read_environment, "max30105": read_max30105})
+
+    def handle_input(seconds):
+        """
+        used by the scheduler in place of sleep, waits until the next task
+        is due while handling trackball events as soon as they arrive
+        nb - currently only the button is used, motion is ignored
+        """
+        nonlocal display_index
+        end = monotonic() + seconds
+        while True:
+            event = trackball_input.get(timeout=max(0, end - monotonic()))
+            if event is None:
+                return
+            kind, value = event
             # cycle to next name and reading when trackball pressed
-            if read_tb == "sp":
+            if kind == "press":
                 display_index += 1
                 if display_index == 7:
                     display_index = 0
                 name = display_names[display_index]
                 draw_lcd(name, 0)
-                sleep(0.9)
-                break
-            elif read_tb == "lp":
+                # leave the name on the display for a moment
+                scheduler.defer("display", 0.9)
+            elif kind == "long_press":
                 raise KeyboardInterrupt
-            sleep(0.1)
-        
-        # read raw data from sensors and calculate air quality
-        readings = read_environment()
+
+    scheduler = Scheduler(sleeper=handle_input)
+    aggregator = Aggregator(rollup_period, DECIMALS)
+
+    def print_alert(alert):
+        print("ALERT:" if alert["state"] == "raised" else "CLEARED:",
+              alert["rule"], alert["reading"], alert["limits"])
+
+    notifiers = [print_alert]
+    if MQTT_broadcast == True:
+        notifiers += [publish_alert]
+    alert_engine = AlertEngine(channel_names, alert_rules, notifiers, alert_interval)
+
+    @timed("sensor_sample_seconds", "time to take, publish and check a reading")
+    def sample():
+        nonlocal formatted_readings, warning
+        date_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # read raw data from both sensors at once, the max30105 is read
+        # while the bme680 waits for its gas heater
+        samples = acquisition.sample()
+        time_stamp, readings = samples["bme680"]
+
+        # calculate air quality
         humidity = readings[2]
         gas = readings[3]
-        air_quality = calc_air_quality(humidity, gas)
+        if gas_calibration == True:
+            air_quality = gas_baseline.score(humidity, gas)
+        else:
+            air_quality = calc_air_quality(humidity, gas)
         readings += [air_quality]
         
-         # read data from max30105 particle sensor
+        # add data from max30105 particle sensor
         # !! this needs to be amended to be included in main readings data !!
-        particles, temp = read_max30105()
+        particle_time, particle_readings = samples["max30105"]
+        particles, temp = particle_readings[:2]
         readings += [particles]
         
-        
-        # publish raw data from sensor readings to AWS
-        if MQTT_broadcast == True:
-            publish_readings(readings)
+        # queue raw data from sensor readings to publish to AWS, or add
+        # them to this minute's rollup
+        if MQTT_broadcast == True and publish_mode == "rollup":
+            rollup = aggregator.add(time_stamp, readings)
+            if rollup is not None:
+                publish_rollup(rollup)
+        elif MQTT_broadcast == True:
+            publish_readings(readings, time_stamp)
         
         # format the readings, store in a list and print to console
         air = format_air(air_quality)
@@ -325,7 +648,20 @@ def main():
         formatted_readings += format_readings(readings)
         formatted_readings += [air]
         print(date_stamp, display_names[display_index], formatted_readings)
-        
+        if max30105_burst == True:
+            print("particles mean %.1f variance %.1f" % (particles, particle_readings[2]))
+
+        # set trackball LED to Red colour while any alerts are raised
+        alert_engine.update(readings, time_stamp)
+        if alert_engine.active():
+            warning = 1
+        else:
+            warning = 0
+
+    def refresh_display():
+        nonlocal tick
+        if formatted_readings is None:
+            return
         # set decimal point only on LED display for readings that need it
         # temperature, humidity and air quality
         if display_index in [2, 4, 5]:
@@ -343,33 +679,63 @@ def main():
         
         # display current formatted reading to LED display
         draw_lcd(formatted_readings[display_index], decimal_point)
-        
+
+        # flash trackball LED while there is a warning
+        if warning == 1:
+            if tick == True:
+                light_trackball(1)
+            else:
+                light_trackball(0)
+        else:
+            light_trackball(0)
+
+    def check_brightness():
+        nonlocal time_of_day
         # change brightness of led matrix depending on time of day
         # dims display after 9pm and before 9am
         hour_now = datetime.now().hour
         if hour_now > 9 and  hour_now < 21 and time_of_day == "night":
             bright_lcd(True)
             time_of_day = "day"
-        if hour_now > 21 and time_zone == "day":
+        if hour_now > 21 and time_of_day == "day":
             bright_lcd(False)
             time_of_day = "night"
-        
-        # set trackball LED to Red colour if any readings fall outside of range
-        for index, reading in enumerate(readings):
-            if reading < warnings[index][0] or reading > warnings[index][1]:
-                warning = 1
-                print("WARNING:", index, reading, warnings[index])
-                break
-            else:
-                warning = 0
-        if warning == 1:
-            if tick == True:
-                light_trackball(1)
-            else:
-                light_trackball(0)
-        else:
-            light_trackball(0)
-        
+
+    def report():
+        scheduler.report()
+        waiting = [name for name, done in readiness().items() if not done]
+        if waiting:
+            print("not ready:", ", ".join(waiting))
+        if gas_calibration == True and gas_baseline.resistance() is not None:
+            print("gas baseline %d ohms from %d readings"
+                  % (gas_baseline.resistance(), gas_baseline.count))
+
+    def stats():
+        publish_stats({"time": time(),
+                       "timings": registry.summary(),
+                       "scheduler": scheduler.stats(),
+                       "dropped_readings": dropped_readings,
+                       "spooled_bytes": len(spool),
+                       "spool_dropped_segments": spool.dropped,
+                       "spool_corrupt_records": spool.corrupt,
+                       "last_read_ms": {name: round(seconds * 1000, 2)
+                                        for name, seconds in acquisition.durations.items()},
+                       "display_writes": lcd.writes,
+                       "alerts_suppressed": alert_engine.suppressed,
+                       "ready": readiness()})
+
+    draw_lcd(display_names[display_index], 0)
+    if MQTT_broadcast == True:
+        start_publisher()
+        scheduler.add("stats", stats_period, stats, delay=stats_period)
+    # the display is refreshed just after each sample is taken
+    scheduler.add("sample", sample_period, sample, delay=1)
+    scheduler.add("display", display_period, refresh_display, delay=1.05)
+    scheduler.add("brightness", brightness_period, check_brightness)
+    scheduler.add("report", report_period, report, delay=report_period)
+    if gas_calibration == True:
+        scheduler.add("baseline", baseline_period, gas_baseline.save, delay=baseline_period)
+    scheduler.run()
        
     print("its not working")
     return 
@@ -380,14 +746,14 @@ if __name__ == '__main__':
     except Exception as e:
         print(e)
     except KeyboardInterrupt:
-        # if keyboard interrupt then blank display
-        display = LTP305(address=97)
-        display.clear()
-        display.show()
-        display = LTP305(address=99)
-        display.clear()
-        display.show()
-        light_trackball(0)
-        max30105.set_slot_mode(1, 'off')
-        max30105.set_slot_mode(2, 'off')
-        max30105.set_slot_mode(3, 'off')
+        # if keyboard interrupt then blank display (if it was set up)
+        if ready["lcd"].is_set():
+            lcd.blank()
+        if gas_baseline is not None:
+            gas_baseline.save()
+        if ready["trackball"].is_set():
+            light_trackball(0)
+        if ready["max30105"].is_set():
+            max30105.set_slot_mode(1, 'off')
+            max30105.set_slot_mode(2, 'off')
+            max30105.set_slot_mode(3, 'off')
@@ -0,0 +1,193 @@
+"""
+Lightweight timing metrics for the Environment Sensor and dashboard
+
+Histograms with fixed buckets, so they use the same memory however long the
+program runs, and cost a lock and a few additions per observation. Shown in
+Prometheus text format by the dashboard's /metrics page and summarised in
+the sensor's periodic stats message.
+
+    from metrics import registry, timed
+
+    @timed("sensor_read_seconds", "time to read the sensors")
+    def read_sensors():
+        ...
+
+    registry.histogram("reading_age_seconds").observe(age)
+    registry.counter("bad_messages_total").inc()
+"""
+
+import functools
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+# bucket upper bounds (seconds), from half a millisecond to a minute
+BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1, 2.5, 5, 10, 30, 60]
+
+# =====================================================================
+### Histogram class ##########################
+
+class Histogram:
+    """
+    counts observations into buckets, plus their count, sum and maximum
+    """
+
+    def __init__(self, name, help="", buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)    # last is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+        return
+
+    def quantile(self, q):
+        """
+        estimate the q quantile (0 - 1) by interpolating within its
+        bucket, None if nothing has been observed
+        """
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            largest = self.max
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            if seen + n >= rank and n > 0:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else largest
+                return min(largest, low + (high - low) * (rank - seen) / n)
+            seen += n
+        return largest
+
+    def summary(self):
+        # count, mean, median, 95th percentile and maximum, in milliseconds
+        with self.lock:
+            count = self.count
+            mean = self.sum / count if count else 0.0
+            largest = self.max
+        p50 = self.quantile(0.5) or 0.0
+        p95 = self.quantile(0.95) or 0.0
+        return {"count": count,
+                "mean_ms": round(mean * 1000, 2),
+                "p50_ms": round(p50 * 1000, 2),
+                "p95_ms": round(p95 * 1000, 2),
+                "max_ms": round(largest * 1000, 2)}
+
+    def render(self):
+        # Prometheus text format lines
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.sum
+        lines = ["# HELP %s %s" % (self.name, self.help),
+                 "# TYPE %s histogram" % self.name]
+        cumulative = 0
+        for bound, n in zip(self.buckets + ["+Inf"], counts):
+            cumulative += n
+            lines.append('%s_bucket{le="%s"} %d' % (self.name, bound, cumulative))
+        lines.append("%s_sum %r" % (self.name, total))
+        lines.append("%s_count %d" % (self.name, count))
+        return lines
+
+# =====================================================================
+### Counter class ############################
+
+class Counter:
+    """
+    a count of events, e.g. messages dropped
+    """
+
+    def __init__(self, name, help=""):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+        return
+
+    def render(self):
+        # Prometheus text format lines
+        return ["# HELP %s %s" % (self.name, self.help),
+                "# TYPE %s counter" % self.name,
+                "%s %d" % (self.name, self.value)]
+
+# =====================================================================
+### Registry class ###########################
+
+class Registry:
+    """
+    the histograms and counters for one program, created on first use
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name, help="", buckets=BUCKETS):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, Histogram(name, help, buckets))
+        return histogram
+
+    def counter(self, name, help=""):
+        counter = self.counters.get(name)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.setdefault(name, Counter(name, help))
+        return counter
+
+    def summary(self):
+        summary = {name: h.summary() for name, h in sorted(self.histograms.items())}
+        summary.update((name, c.value) for name, c in sorted(self.counters.items()))
+        return summary
+
+    def render(self):
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            lines += histogram.render()
+        for name, counter in sorted(self.counters.items()):
+            lines += counter.render()
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# =====================================================================
+### Timing functions #########################
+
+def timed(name, help=""):
+    """
+    decorator recording how long each call of a function takes in the
+    histogram 'name'
+    """
+    def decorator(function):
+        histogram = registry.histogram(name, help)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start)
+        return wrapper
+    return decorator
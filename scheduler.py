@@ -0,0 +1,123 @@
+"""
+Deadline-driven scheduler for the Environment Sensor main loop
+
+Each task runs at its own fixed period on the monotonic clock. Deadlines are
+worked out from the start time rather than from when the task last finished,
+so periods don't drift however long the tasks take. Records how late each
+run starts (jitter) so the actual sample rate is known.
+"""
+
+import heapq
+from math import ceil, sqrt
+from time import monotonic, sleep
+
+# =====================================================================
+### Task class ###############################
+
+class Task:
+    """
+    a function called every 'period' seconds, with running jitter
+    statistics (Welford's method, so fixed memory however long it runs)
+    """
+
+    def __init__(self, name, period, function, start):
+        self.name = name
+        self.period = period
+        self.function = function
+        self.deadline = start
+        self.runs = 0
+        self.overruns = 0       # deadlines skipped because a run was too late
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.worst = 0.0
+
+    def record(self, late):
+        # add how late (seconds) a run started to the statistics
+        self.runs += 1
+        delta = late - self.mean
+        self.mean += delta / self.runs
+        self.m2 += delta * (late - self.mean)
+        self.worst = max(self.worst, late)
+        return
+
+    def stats(self):
+        stdev = sqrt(self.m2 / self.runs) if self.runs > 1 else 0.0
+        return {"runs": self.runs,
+                "mean_ms": round(self.mean * 1000, 2),
+                "stdev_ms": round(stdev * 1000, 2),
+                "max_ms": round(self.worst * 1000, 2),
+                "overruns": self.overruns}
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+# =====================================================================
+### Scheduler class ##########################
+
+class Scheduler:
+    """
+    runs tasks at their deadlines, sleeping in between
+    if a task falls more than a whole period behind, the missed runs are
+    skipped (and counted as overruns) rather than run back to back
+    """
+
+    def __init__(self, clock=monotonic, sleeper=sleep):
+        # sleeper(seconds) waits until the next deadline, it can be replaced
+        # by a function that handles input events while it waits
+        self.clock = clock
+        self.sleeper = sleeper
+        self.tasks = {}
+        self.queue = []
+
+    def add(self, name, period, function, delay=0):
+        task = Task(name, period, function, self.clock() + delay)
+        self.tasks[name] = task
+        heapq.heappush(self.queue, task)
+        return task
+
+    def defer(self, name, seconds):
+        # push a task's next run back by 'seconds' from now, e.g. to leave a
+        # name on the display for a while after a button press
+        task = self.tasks[name]
+        task.deadline = max(task.deadline, self.clock() + seconds)
+        heapq.heapify(self.queue)
+        return
+
+    def run_once(self):
+        # wait for the next deadline and run that task
+        task = self.queue[0]
+        wait = task.deadline - self.clock()
+        if wait > 0:
+            self.sleeper(wait)
+            # the sleeper may handle events that defer tasks, so make sure
+            # this task is still the one due
+            if self.queue[0] is not task or task.deadline > self.clock():
+                return
+        now = self.clock()
+        task.record(max(0.0, now - task.deadline))
+        task.function()
+        task.deadline += task.period
+        now = self.clock()
+        if task.deadline <= now:
+            missed = ceil((now - task.deadline) / task.period)
+            task.overruns += missed
+            task.deadline += missed * task.period
+        # the task may have deferred others, so re-sort rather than assume
+        # it is still at the front of the queue
+        heapq.heapify(self.queue)
+        return
+
+    def run(self):
+        while True:
+            self.run_once()
+
+    def stats(self):
+        return {name: task.stats() for name, task in self.tasks.items()}
+
+    def report(self):
+        # print jitter statistics for every task
+        for name, stats in self.stats().items():
+            print("%-10s runs %d  jitter mean %sms stdev %sms max %sms  overruns %d"
+                  % (name, stats["runs"], stats["mean_ms"], stats["stdev_ms"],
+                     stats["max_ms"], stats["overruns"]))
+        return
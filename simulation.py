@@ -0,0 +1,393 @@
+"""
+Hardware-free stand-ins for the Environment Sensor
+
+Simulated versions of the four breakout boards (LTP305, MAX30105, TrackBall
+and BME680), RPi.GPIO and the AWS IoT MQTT client, so the sensor program
+and the dashboard can be run, profiled and benchmarked on any computer.
+install() puts them in sys.modules in place of the real libraries, so it
+must be called before main_project_v02 or application is imported.
+
+Every simulated I2C transfer and MQTT publish takes a configurable time
+and fails (OSError / Exception like the real libraries) with a
+configurable probability, and all I2C transfers are counted on a shared
+bus so the number of transfers per sample can be measured.
+"""
+
+import math
+import random
+import sys
+import threading
+import types
+from time import sleep, time, monotonic
+
+from trackball_input import FakeGPIO
+
+# =====================================================================
+### I2C bus ##################################
+
+class Bus:
+    """
+    shared by all the simulated boards, each transfer waits latency seconds
+    and raises OSError with probability fault_rate
+    """
+
+    def __init__(self, latency=0.0005, fault_rate=0.0, seed=None):
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.faults = 0
+
+    def transfer(self, count=1):
+        # count transfers, e.g. a FIFO read of several blocks
+        with self.lock:
+            self.calls += count
+            fault = self.random.random() < self.fault_rate
+            if fault:
+                self.faults += 1
+        if self.latency:
+            sleep(self.latency * count)
+        if fault:
+            raise OSError(121, "Remote I/O error (simulated)")
+        return
+
+bus = Bus()
+
+# =====================================================================
+### LED matrix display #######################
+
+class LTP305:
+    # characters are buffered like the real library, show() sends them
+    def __init__(self, address=0x61, brightness=0.5):
+        self.address = address
+        self.brightness = brightness
+        self.buffer = [None, None, 0]
+        self.shown = None
+        bus.transfer()
+
+    def clear(self):
+        self.buffer = [None, None, 0]
+
+    def set_character(self, x, char):
+        self.buffer[0 if x < 5 else 1] = char
+
+    def set_decimal(self, left=None, right=None):
+        if left is not None:
+            self.buffer[2] = left
+
+    def set_brightness(self, brightness, update=False):
+        self.brightness = brightness
+        if update:
+            bus.transfer()
+
+    def show(self):
+        bus.transfer(3)
+        self.shown = list(self.buffer)
+
+# =====================================================================
+### Particle sensor ##########################
+
+class MAX30105:
+    """
+    fills its 32 sample FIFO at sample_rate / sample_average samples a
+    second while running, like the real sensor, losing the oldest samples
+    when it overflows
+    """
+
+    def __init__(self, i2c_addr=0x57):
+        self.sample_rate = 400
+        self.sample_average = 4
+        self.leds = 3
+        self.last_read = monotonic()
+        self.level = 60.0
+        self.overflows = 0
+        bus.transfer()
+
+    def setup(self, led_power=6.4, sample_average=4, leds_enable=3, sample_rate=400,
+              pulse_width=215, adc_range=16384, timeout=5.0):
+        self.sample_average = sample_average
+        self.leds = leds_enable
+        self.sample_rate = sample_rate
+        self.last_read = monotonic()
+        bus.transfer(8)
+
+    def set_led_pulse_amplitude(self, led, amplitude):
+        bus.transfer()
+
+    def set_slot_mode(self, slot, mode):
+        bus.transfer()
+
+    def get_samples(self):
+        now = monotonic()
+        count = int((now - self.last_read) * self.sample_rate / self.sample_average)
+        if count > 32:
+            self.overflows += 1
+            count = 32
+        bus.transfer(1 + count)
+        if count == 0:
+            return None
+        self.last_read = now
+        samples = []
+        for _ in range(count):
+            # a slowly wandering particle level with some noise
+            self.level = min(250.0, max(0.0, self.level + random.gauss(0, 0.5)))
+            green = int(self.level + random.gauss(0, 3)) & 0xff
+            samples += [random.randint(0, 0x3ffff), random.randint(0, 0x3ffff), green][:self.leds]
+        return samples
+
+    def get_temperature(self):
+        bus.transfer(2)
+        return round(30 + random.gauss(0, 0.1), 4)
+
+class HeartRate:
+    # same filter as the real library, which only does arithmetic
+    FIR_COEFFS = [172, 321, 579, 927, 1360, 1858, 2390, 2916, 3391, 3768, 4012, 4096]
+
+    def __init__(self, max30105):
+        self.max30105 = max30105
+        self._buffer = [0] * 32
+        self._offset = 0
+
+    def low_pass_fir(self, sample):
+        self._buffer[self._offset] = sample
+        z = self.FIR_COEFFS[11] * self._buffer[(self._offset - 11) & 0x1f]
+        for i in range(11):
+            z += self.FIR_COEFFS[i] * (self._buffer[(self._offset - i) & 0x1f]
+                                       + self._buffer[(self._offset - 22 + i) & 0x1f])
+        self._offset = (self._offset + 1) % 32
+        return z >> 15
+
+# =====================================================================
+### Trackball ################################
+
+class TrackBall:
+    """
+    press(seconds) holds the button down for that long, firing the
+    interrupt pin through the simulated GPIO like the real trackball
+    """
+
+    def __init__(self, address=0x0A, i2c_bus=1, interrupt_pin=None, timeout=5):
+        self.interrupt_pin = interrupt_pin
+        self.state = False
+        self.changed = False
+        self.colour = (0, 0, 0, 0)
+        bus.transfer()
+
+    def set_rgbw(self, r, g, b, w):
+        self.colour = (r, g, b, w)
+        bus.transfer()
+
+    def read(self, timeout=0.5):
+        bus.transfer()
+        switch, self.changed = self.changed, False
+        return 0, 0, 0, 0, switch, self.state
+
+    def _set(self, state):
+        self.state = state
+        self.changed = True
+        if self.interrupt_pin is not None:
+            gpio.trigger(self.interrupt_pin)
+
+    def press(self, seconds=0.1):
+        self._set(True)
+        timer = threading.Timer(seconds, self._set, [False])
+        timer.daemon = True
+        timer.start()
+        return
+
+# =====================================================================
+### Environment sensor #######################
+
+class BME680Data:
+    def __init__(self):
+        self.temperature = 21.0
+        self.pressure = 1013.0
+        self.humidity = 40.0
+        self.gas_resistance = 80000.0
+        self.heat_stable = False
+
+class BME680:
+    """
+    forced mode reads take measure_time seconds (the real sensor takes about
+    40 ms plus the gas heater duration), the gas reading becomes heat
+    stable after the first few
+    """
+
+    def __init__(self, i2c_addr=0x76, i2c_device=None):
+        self.i2c_addr = i2c_addr
+        self.data = BME680Data()
+        self.heater_duration = 0
+        self.reads = 0
+        self.measure_time = 0.19
+        bus.transfer(4)
+
+    def _setting(self, *args):
+        bus.transfer()
+
+    set_humidity_oversample = _setting
+    set_pressure_oversample = _setting
+    set_temperature_oversample = _setting
+    set_filter = _setting
+    set_gas_status = _setting
+    set_gas_heater_temperature = _setting
+    select_gas_heater_profile = _setting
+
+    def set_gas_heater_duration(self, value, nb_profile=0):
+        self.heater_duration = value
+        bus.transfer()
+
+    def get_sensor_data(self):
+        bus.transfer(3)
+        sleep(self.measure_time)
+        self.reads += 1
+        data = self.data
+        data.temperature += random.gauss(0, 0.02)
+        data.pressure += random.gauss(0, 0.05)
+        data.humidity = min(99.9, max(0.0, data.humidity + random.gauss(0, 0.05)))
+        data.gas_resistance = max(1000.0, data.gas_resistance * math.exp(random.gauss(0, 0.01)))
+        data.heat_stable = self.reads > 3
+        return True
+
+def _bme680_module():
+    module = types.ModuleType("bme680")
+    module.BME680 = BME680
+    module.I2C_ADDR_PRIMARY = 0x76
+    module.I2C_ADDR_SECONDARY = 0x77
+    module.OS_2X, module.OS_4X, module.OS_8X = 2, 3, 4
+    module.FILTER_SIZE_3 = 2
+    module.ENABLE_GAS_MEAS = 1
+    return module
+
+# =====================================================================
+### GPIO #####################################
+
+# trackball_input's RPi.GPIO stand-in, trigger(pin) fires a falling edge
+gpio = FakeGPIO()
+
+# =====================================================================
+### MQTT #####################################
+
+class Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+class Broker:
+    """
+    in-process MQTT broker shared by every simulated client, so the sensor
+    and the dashboard can talk to each other in one process. published
+    lists (epoch time, topic, payload) of every message
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = []
+        self.published = []
+
+    def publish(self, topic, payload):
+        with self.lock:
+            self.published.append((time(), topic, payload))
+            callbacks = [c for pattern, c in self.subscriptions if _matches(pattern, topic)]
+        for callback in callbacks:
+            callback(None, None, Message(topic, payload))
+
+def _matches(pattern, topic):
+    # MQTT topic filter with + and # wildcards
+    pattern = pattern.split("/")
+    topic = topic.split("/")
+    for i, part in enumerate(pattern):
+        if part == "#":
+            return True
+        if i >= len(topic) or (part != "+" and part != topic[i]):
+            return False
+    return len(pattern) == len(topic)
+
+broker = Broker()
+
+class AWSIoTMQTTClient:
+    """
+    stands in for AWSIoTPythonSDK's client, connecting to the in-process
+    broker. publishes take latency seconds and raise with probability
+    fault_rate, set_online(False) drops the connection
+    """
+
+    latency = 0.02
+    connect_latency = 0.5
+    fault_rate = 0.0
+
+    def __init__(self, clientId, *args, **kwargs):
+        self.clientId = clientId
+        self.onOnline = None
+        self.onOffline = None
+        self.online = False
+
+    def _configure(self, *args, **kwargs):
+        return
+
+    configureEndpoint = _configure
+    configureCredentials = _configure
+    configureAutoReconnectBackoffTime = _configure
+    configureOfflinePublishQueueing = _configure
+    configureDrainingFrequency = _configure
+    configureConnectDisconnectTimeout = _configure
+    configureMQTTOperationTimeout = _configure
+
+    def connect(self, keepAliveIntervalSecond=600):
+        sleep(self.connect_latency)
+        self.set_online(True)
+        return True
+
+    def set_online(self, online):
+        self.online = online
+        callback = self.onOnline if online else self.onOffline
+        if callback is not None:
+            callback()
+
+    def subscribe(self, topic, QoS, callback):
+        with broker.lock:
+            broker.subscriptions.append((topic, callback))
+        return True
+
+    def publish(self, topic, payload, QoS):
+        sleep(self.latency)
+        if not self.online or random.random() < self.fault_rate:
+            raise Exception("publish timeout (simulated)")
+        if isinstance(payload, str):
+            payload = payload.encode()
+        broker.publish(topic, payload)
+        return True
+
+# =====================================================================
+### Install function #########################
+
+def install(i2c_latency=0.0005, i2c_fault_rate=0.0, mqtt_latency=0.02,
+            mqtt_fault_rate=0.0, connect_latency=0.5):
+    """
+    replace the hardware and AWS libraries with the stand-ins above and set
+    their latencies (seconds) and fault rates (probability per call)
+    """
+    bus.latency = i2c_latency
+    bus.fault_rate = i2c_fault_rate
+    AWSIoTMQTTClient.latency = mqtt_latency
+    AWSIoTMQTTClient.fault_rate = mqtt_fault_rate
+    AWSIoTMQTTClient.connect_latency = connect_latency
+
+    modules = {}
+    modules["ltp305"] = types.ModuleType("ltp305")
+    modules["ltp305"].LTP305 = LTP305
+    modules["max30105"] = types.ModuleType("max30105")
+    modules["max30105"].MAX30105 = MAX30105
+    modules["max30105"].HeartRate = HeartRate
+    modules["trackball"] = types.ModuleType("trackball")
+    modules["trackball"].TrackBall = TrackBall
+    modules["bme680"] = _bme680_module()
+    modules["RPi"] = types.ModuleType("RPi")
+    modules["RPi"].GPIO = gpio
+    modules["RPi.GPIO"] = gpio
+    modules["AWSIoTPythonSDK"] = types.ModuleType("AWSIoTPythonSDK")
+    modules["AWSIoTPythonSDK.MQTTLib"] = types.ModuleType("AWSIoTPythonSDK.MQTTLib")
+    modules["AWSIoTPythonSDK.MQTTLib"].AWSIoTMQTTClient = AWSIoTMQTTClient
+    modules["AWSIoTPythonSDK"].MQTTLib = modules["AWSIoTPythonSDK.MQTTLib"]
+    sys.modules.update(modules)
+    return
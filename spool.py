@@ -0,0 +1,229 @@
+"""
+Disk-backed store-and-forward spool for the Environment Sensor
+
+Messages waiting to be published are appended to segment files on the SD
+card, so a network outage doesn't grow memory and a reboot doesn't lose
+them. A drainer reads them back in order and publishes them once the MQTT
+connection is up.
+"""
+
+import os
+import struct
+import threading
+import zlib
+from time import time
+
+# every record starts with a header of MAGIC, the message length and the
+# message's CRC32, so torn or corrupt records can be found and skipped
+MAGIC = 0x5AA5
+HEADER = struct.Struct("<HII")
+
+# =====================================================================
+### Spool class ##############################
+
+class Spool:
+    """
+    append-only spool of messages kept in numbered segment files, e.g.
+    spool/00000012.seg, each message stored as a header (see HEADER) and
+    the message bytes
+
+    appends are only fsync'd every sync_seconds to keep SD card writes down,
+    so at most that much is lost on a power cut. the read position is saved
+    at the same time, so after a crash a few messages may be published
+    twice. a power cut can also leave half a record at the end of the last
+    segment, which is cut off when the spool is opened again, and any
+    record whose CRC doesn't match is skipped when read (counted in
+    corrupt). segments are deleted once read, and the oldest messages are
+    dropped if the spool grows beyond max_bytes
+    """
+
+    def __init__(self, directory, max_bytes=50000000, segment_bytes=1000000, sync_seconds=30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.sync_seconds = sync_seconds
+        self.changed = threading.Condition()
+        self.dropped = 0          # unread segments dropped to stay under max_bytes
+        self.corrupt = 0          # corrupt records (or runs of bytes) skipped
+        os.makedirs(directory, exist_ok=True)
+        self.sizes = {}
+        for name in os.listdir(directory):
+            if name.endswith(".seg"):
+                self.sizes[int(name[:-4])] = os.path.getsize(os.path.join(directory, name))
+        if not self.sizes:
+            self.sizes[0] = 0
+        self.write_segment = max(self.sizes)
+        self._recover(self.write_segment)
+        self.writer = open(self._path(self.write_segment), "ab")
+        # read position is (segment, offset), saved in the position file
+        self.read_segment, self.read_offset = min(self.sizes), 0
+        try:
+            with open(os.path.join(directory, "position")) as f:
+                segment, offset = [int(x) for x in f.read().split()]
+            if segment in self.sizes:
+                self.read_segment = segment
+                self.read_offset = min(offset, self.sizes[segment])
+        except (OSError, ValueError):
+            pass
+        self.reader = None
+        self.next_offset = None
+        self.last_sync = time()
+
+    def _path(self, segment):
+        return os.path.join(self.directory, "%08d.seg" % segment)
+
+    def _recover(self, segment):
+        # cut the segment off after its last complete record, so appends
+        # don't follow half a record left by a power cut
+        try:
+            with open(self._path(segment), "rb") as f:
+                contents = f.read()
+        except FileNotFoundError:
+            return
+        end = 0
+        position = 0
+        while True:
+            record = _next_record(contents, position)
+            if record is None:
+                break
+            start, end, message = record
+            position = end
+        if end < len(contents):
+            with open(self._path(segment), "r+b") as f:
+                f.truncate(end)
+                os.fsync(f.fileno())
+            self.sizes[segment] = end
+        return
+
+    def __len__(self):
+        # bytes waiting to be read
+        return sum(self.sizes.values()) - self.read_offset
+
+    def append(self, message):
+        # add a message to the end of the spool
+        with self.changed:
+            if self.sizes[self.write_segment] >= self.segment_bytes:
+                self.sync()
+                self.writer.close()
+                self.write_segment += 1
+                self.sizes[self.write_segment] = 0
+                self.writer = open(self._path(self.write_segment), "ab")
+            self.writer.write(HEADER.pack(MAGIC, len(message), zlib.crc32(message)) + message)
+            self.sizes[self.write_segment] += HEADER.size + len(message)
+            while sum(self.sizes.values()) > self.max_bytes and len(self.sizes) > 1:
+                self._drop_oldest()
+            if time() - self.last_sync >= self.sync_seconds:
+                self.sync()
+            self.changed.notify_all()
+        return
+
+    def _drop_oldest(self):
+        # delete the oldest segment, moving the read position past it
+        oldest = min(self.sizes)
+        if oldest == self.read_segment:
+            self.dropped += 1
+            print("spool over %d bytes, dropped %d unsent bytes"
+                  % (self.max_bytes, self.sizes[oldest] - self.read_offset))
+            self._next_segment()
+        else:
+            self._delete(oldest)
+        return
+
+    def _delete(self, segment):
+        del self.sizes[segment]
+        os.remove(self._path(segment))
+        return
+
+    def _next_segment(self):
+        # finished reading a segment, delete it and move on to the next one
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        finished = self.read_segment
+        self.read_segment = min(s for s in self.sizes if s > finished)
+        self.read_offset = 0
+        self.next_offset = None
+        self._delete(finished)
+        return
+
+    def sync(self):
+        # flush appended messages to the SD card and save the read position
+        with self.changed:
+            self.writer.flush()
+            os.fsync(self.writer.fileno())
+            path = os.path.join(self.directory, "position")
+            with open(path + ".tmp", "w") as f:
+                f.write("%d %d" % (self.read_segment, self.read_offset))
+            os.replace(path + ".tmp", path)
+            self.last_sync = time()
+        return
+
+    def peek(self, timeout=None):
+        """
+        return the next unread message without moving past it, waiting up
+        to timeout seconds for one to be appended. returns None if there
+        isn't one
+        """
+        with self.changed:
+            while True:
+                message = self._read()
+                if message is not None or timeout is None:
+                    return message
+                self.changed.wait(timeout)
+                timeout = None
+
+    def _read(self):
+        if self.read_segment == self.write_segment:
+            self.writer.flush()
+        if self.reader is None:
+            self.reader = open(self._path(self.read_segment), "rb")
+        self.reader.seek(self.read_offset)
+        header = self.reader.read(HEADER.size)
+        if len(header) < HEADER.size:
+            if self.read_segment < self.write_segment:
+                self._next_segment()
+                return self._read()
+            return None
+        magic, length, crc = HEADER.unpack(header)
+        message = self.reader.read(length) if magic == MAGIC else b""
+        if magic == MAGIC and len(message) == length and zlib.crc32(message) == crc:
+            self.next_offset = self.read_offset + HEADER.size + length
+            return message
+        # not a whole good record (appends are written and flushed under
+        # the lock, so it's never one still being written), skip to the next
+        # good record or the end of the segment
+        self.reader.seek(self.read_offset)
+        contents = self.reader.read()
+        record = _next_record(contents, 1)
+        self.corrupt += 1
+        print("skipped a corrupt spool record in segment %d" % self.read_segment)
+        self.read_offset += record[0] if record is not None else len(contents)
+        return self._read()
+
+    def advance(self):
+        # move past the message returned by peek once it has been published
+        with self.changed:
+            if self.next_offset is not None:
+                self.read_offset = self.next_offset
+                self.next_offset = None
+            if time() - self.last_sync >= self.sync_seconds:
+                self.sync()
+        return
+
+def _next_record(contents, position):
+    """
+    find the first good record in contents (bytes) at or after position,
+    returns (start, end, message) or None if there isn't one
+    """
+    magic = struct.pack("<H", MAGIC)
+    while True:
+        start = contents.find(magic, position)
+        if start < 0 or start + HEADER.size > len(contents):
+            return None
+        magic_value, length, crc = HEADER.unpack_from(contents, start)
+        end = start + HEADER.size + length
+        if end <= len(contents):
+            message = contents[start + HEADER.size:end]
+            if zlib.crc32(message) == crc:
+                return start, end, message
+        position = start + 1
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import air_quality
+
+
+@pytest.fixture(scope="module")
+def scalar(simulated):
+    # the scalar functions, importing main_project_v02 with simulated hardware
+    import main_project_v02
+    return main_project_v02
+
+
+def stored_readings(count, seed=0):
+    # random float readings, as the ring buffer and disk store keep them.
+    # particle readings are whole numbers, a few aren't
+    rng = np.random.default_rng(seed)
+    readings = np.column_stack([rng.uniform(-20, 45, count),
+                                rng.uniform(900, 1100, count),
+                                rng.uniform(0, 100, count),
+                                rng.uniform(0, 150000, count),
+                                rng.uniform(0, 99.9, count),
+                                np.floor(rng.uniform(0, 15000, count))])
+    readings[::100, 5] += 0.5
+    readings[::7, 0] = np.round(readings[::7, 0], 2)
+    return readings
+
+
+def test_same_results_as_the_scalar_functions(scalar):
+    readings = stored_readings(50000)
+    humidity, gas = readings[:, 2], readings[:, 3]
+    quality = air_quality.calc_air_quality(humidity, gas)
+    assert quality.tolist() == [scalar.calc_air_quality(h, g)
+                                for h, g in zip(humidity.tolist(), gas.tolist())]
+    assert air_quality.format_air(quality).tolist() == [scalar.format_air(q)
+                                                        for q in quality.tolist()]
+    assert air_quality.format_readings(readings).tolist() == \
+        [scalar.format_readings(row) for row in readings.tolist()]
+
+
+def test_missing_readings_are_dashes():
+    readings = [[21.5, 1013.0, 40.0, 81000.0, 92.4, np.nan],
+                [np.nan, np.nan, np.nan, np.nan, np.nan, 60.0]]
+    assert air_quality.format_readings(readings).tolist() == \
+        [["215c", "1013", "400%", "81ko", "----"],
+         ["----", "----", "----", "----", "60.0"]]
+    assert air_quality.format_air([92.4, np.nan]).tolist() == ["924%", "---%"]
+    assert np.isnan(air_quality.calc_air_quality([40.0], [np.nan])[0])
@@ -0,0 +1,67 @@
+import pytest
+
+from alerts import AlertEngine, Rule
+
+
+def states(rule, readings, start=0, step=1):
+    # check one reading every 'step' seconds, returning each check's result
+    return [rule.check(start + i * step, reading) for i, reading in enumerate(readings)]
+
+
+def test_limit_alert_clears_only_inside_the_hysteresis_band():
+    rule = Rule("temperature", "temperature", 5, 25, hysteresis=0.5)
+    assert states(rule, [24, 25.5, 24.8, 24.6, 24.4]) == \
+        [None, "raised", None, None, "cleared"]
+    assert states(rule, [4.9, 5.3, 5.6]) == ["raised", None, "cleared"]
+
+
+def test_limit_alert_needs_the_minimum_duration():
+    rule = Rule("smoke", "smoke", high=50, duration=10)
+    # a short spike doesn't raise, and restarts the duration
+    assert states(rule, [60, 60, 40, 60], step=5) == [None, None, None, None]
+    assert rule.check(20, 60) is None
+    assert rule.check(25, 60) == "raised"
+
+
+def test_rate_alert_in_either_direction():
+    rule = Rule("temperature changing", "temperature", rate=1 / 60, window=60)
+    # rate is measured every window seconds, and held in between
+    assert states(rule, [20, 21, 22, 22], step=30) == [None, None, "raised", None]
+    assert rule.check(120, 22) == "cleared"
+    assert rule.check(180, 19) == "raised"
+
+
+def test_rate_alert_with_a_direction():
+    rising = Rule("temperature rising", "temperature", rate=1 / 60, window=60,
+                  direction="rising")
+    falling = Rule("temperature falling", "temperature", rate=1 / 60, window=60,
+                   direction="falling")
+    readings = [20, 18, 16, 18, 20]
+    assert states(rising, readings, step=60) == [None, None, None, "raised", None]
+    assert states(falling, readings, step=60) == [None, "raised", None, "cleared", None]
+    with pytest.raises(ValueError):
+        Rule("temperature", "temperature", rate=1, direction="up")
+
+
+def test_notifications_are_rate_limited_and_clears_follow_their_raise():
+    notified = []
+    engine = AlertEngine(["temperature", "humidity"],
+                         [Rule("temperature", "temperature", high=25)],
+                         [notified.append], min_interval=300)
+    events = [engine.update([reading, 40], time_stamp)
+              for time_stamp, reading in [(0, 26), (10, 20), (100, 26), (110, 20),
+                                          (400, 26), (410, 20)]]
+    # every change is returned, but within min_interval of the last raise
+    # neither the raise nor its clear is notified
+    assert [event["state"] for batch in events for event in batch] == \
+        ["raised", "cleared"] * 3
+    assert [(event["time"], event["state"]) for event in notified] == \
+        [(0, "raised"), (10, "cleared"), (400, "raised"), (410, "cleared")]
+    assert engine.suppressed == 1
+    assert notified[0]["reading"] == 26 and notified[0]["limits"]["high"] == 25
+    assert engine.active() == []
+
+
+def test_rule_on_an_unknown_channel_is_rejected():
+    with pytest.raises(ValueError):
+        AlertEngine(["temperature"], [Rule("gas", "gas", low=30000)])
@@ -0,0 +1,79 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+pytest.importorskip("dash")
+
+from history import Rollup
+
+START = datetime(2022, 4, 9, 12, 0, 0)
+
+
+@pytest.fixture(scope="module")
+def application(simulated):
+    # the dashboard with three hours of 1 minute rollups in memory, where
+    # each channel's mean is the minute number. start() isn't run
+    import application
+    application.started = os.getpid()
+    channels = application.channels
+    application.rollups = [Rollup(channels, 60, 1000), Rollup(channels, 3600, 100)]
+    for minute in range(180):
+        for rollup in application.rollups:
+            rollup.add(START + timedelta(minutes=minute), [minute] * len(channels),
+                       [minute - 1] * len(channels), [minute + 1] * len(channels), 60)
+    for rollup in application.rollups:
+        rollup.flush()
+    return application
+
+
+def test_query_history_buckets(application):
+    bucket, resolution, times, results = application.query_history(
+        START, START + timedelta(hours=3), ["Temperature"], bucket=3600, quantiles=[0.5])
+    assert (bucket, resolution) == (3600, 60)
+    assert list(times) == [np.datetime64(START + timedelta(hours=hour), "ms") for hour in range(3)]
+    stats = results["Temperature"]
+    assert list(stats["min"]) == [-1, 59, 119] and list(stats["max"]) == [60, 120, 180]
+    assert list(stats["mean"]) == [29.5, 89.5, 149.5] and list(stats["p50"]) == [29.5, 89.5, 149.5]
+    # buckets line up with multiples of their width, so the first is read
+    # from its start. the end isn't included
+    bucket, resolution, times, results = application.query_history(
+        START + timedelta(minutes=30), START + timedelta(minutes=90), ["Gas"], bucket=1200)
+    assert times[0] == np.datetime64(START + timedelta(minutes=20), "ms")
+    assert results["Gas"]["min"][0] == 19 and results["Gas"]["max"][-1] == 90
+    # and are rounded to whole rollup rows
+    assert application.query_history(START, START + timedelta(hours=1), ["Gas"],
+                                     bucket=1000)[0] == 1020
+
+
+def test_history_api(application):
+    client = application.application.test_client()
+    response = client.get("/api/history?start=2022-04-09T12:00&end=2022-04-09T14:00"
+                          "&channels=Humidity&bucket=3600&stats=min,mean,p100")
+    assert response.status_code == 200
+    body = response.get_json()
+    # local wall clock milliseconds
+    assert body["time"][0] == int(np.datetime64(START, "ms").astype(np.int64))
+    assert body["channels"] == {"Humidity": {"min": [-1, 59], "mean": [29.5, 89.5],
+                                             "p100": [59, 119]}}
+
+
+def test_history_api_with_a_utc_offset(application):
+    client = application.application.test_client()
+    end = (START + timedelta(hours=3)).astimezone()
+    response = client.get("/api/history", query_string={"start": START.isoformat(),
+                                                        "end": end.isoformat(),
+                                                        "bucket": "3600"})
+    assert response.status_code == 200
+    assert response.get_json()["end"] == (START + timedelta(hours=3)).isoformat()
+
+
+@pytest.mark.parametrize("query", ["bucket=nan", "bucket=inf", "bucket=-60", "bucket=x",
+                                   "channels=Wind", "stats=p101", "stats=median",
+                                   "start=2022-04-09T14:00&end=2022-04-09T12:00"])
+def test_history_api_rejects_bad_queries(application, query):
+    client = application.application.test_client()
+    response = client.get("/api/history?" + query)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
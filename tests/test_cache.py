@@ -0,0 +1,83 @@
+import threading
+from time import sleep
+
+import pytest
+
+from cache import LRUCache
+
+
+def test_least_recently_used_is_dropped():
+    cache = LRUCache(2)
+    assert cache.get("a", lambda: 1) == 1
+    assert cache.get("b", lambda: 2) == 2
+    # using "a" makes "b" the least recently used
+    assert cache.get("a", lambda: 0) == 1
+    assert cache.get("c", lambda: 3) == 3
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.get("b", lambda: 4) == 4
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_waiters_share_one_computation():
+    cache = LRUCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "figure"
+    results = []
+    first = threading.Thread(target=lambda: results.append(cache.get("key", compute)))
+    first.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=lambda: results.append(cache.get("key", compute)))
+               for _ in range(3)]
+    for thread in waiters:
+        thread.start()
+    # give the waiters time to find the key pending
+    sleep(0.05)
+    release.set()
+    for thread in [first] + waiters:
+        thread.join(5)
+    assert results == ["figure"] * 4 and len(calls) == 1
+    assert cache.misses == 1
+
+
+def test_a_waiter_takes_over_when_the_computation_fails():
+    cache = LRUCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("no data")
+    errors = []
+
+    def first():
+        try:
+            cache.get("key", failing)
+        except RuntimeError as e:
+            errors.append(e)
+    thread = threading.Thread(target=first)
+    thread.start()
+    started.wait(5)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(cache.get("key", lambda: "figure")))
+    waiter.start()
+    sleep(0.05)
+    release.set()
+    thread.join(5)
+    waiter.join(5)
+    assert len(errors) == 1 and results == ["figure"]
+    assert cache.pending == {} and cache.get("key", lambda: None) == "figure"
+
+
+def test_failure_isnt_cached():
+    cache = LRUCache()
+    with pytest.raises(ZeroDivisionError):
+        cache.get("key", lambda: 1 / 0)
+    assert cache.get("key", lambda: 2) == 2
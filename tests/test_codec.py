@@ -0,0 +1,27 @@
+import pytest
+
+from codec import DECIMALS, decode_batch, encode_batch
+
+
+def test_round_trip_keeps_each_channels_decimal_places():
+    batch = [(1649500000.125, [21.37, 1013.25, 40.5, 81234, 92.4, 61]),
+             (1649500001.125, [21.4, 1013.2, 40.49, 81100, 92.5, 60]),
+             (1649500002.2, [-3.05, 990.01, 100.0, 0, 0.0, 1200])]
+    decoded = decode_batch(encode_batch(batch))
+    assert len(decoded) == len(batch)
+    for (time_stamp, readings), (decoded_time, decoded_readings) in zip(batch, decoded):
+        assert decoded_time == pytest.approx(time_stamp, abs=0.001)
+        for reading, value, decimals in zip(readings, decoded_readings, DECIMALS):
+            assert value == pytest.approx(reading, abs=0.5 * 10 ** -decimals)
+
+
+def test_clock_stepped_back():
+    batch = [(1000.0, [1, 2, 3, 4, 5, 6]), (999.5, [1, 2, 3, 4, 5, 6])]
+    assert [t for t, readings in decode_batch(encode_batch(batch))] == [1000.0, 999.5]
+
+
+def test_unknown_version_is_rejected():
+    payload = bytearray(encode_batch([(1000.0, [1, 2, 3, 4, 5, 6])]))
+    payload[0] = 99
+    with pytest.raises(ValueError):
+        decode_batch(bytes(payload))
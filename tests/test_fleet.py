@@ -0,0 +1,33 @@
+from datetime import datetime
+from math import isnan
+
+from fleet import Fleet
+
+CHANNELS = ["Temperature", "Humidity"]
+
+
+def test_overview_has_each_devices_latest_reading():
+    fleet = Fleet(CHANNELS, max_devices=2)
+    fleet.record("kitchen", datetime(2022, 4, 9, 12, 0), [21.5, 40])
+    fleet.record("garage", datetime(2022, 4, 9, 12, 0), [9.0, 70])
+    fleet.record("kitchen", datetime(2022, 4, 9, 12, 1), [21.75, 41])
+    # no room left in the table, still counted but not shown
+    fleet.record("shed", datetime(2022, 4, 9, 12, 1), [5.0, 80])
+    assert fleet.overview() == [("garage", datetime(2022, 4, 9, 12, 0), [9.0, 70.0], 1,
+                                 [9.0, 70.0], [9.0, 70.0]),
+                                ("kitchen", datetime(2022, 4, 9, 12, 1), [21.75, 41.0], 2,
+                                 [21.5, 40.0], [21.75, 41.0])]
+    assert fleet.devices["shed"].count == 1
+
+
+def test_recent_range_covers_the_last_readings_and_skips_missing():
+    fleet = Fleet(CHANNELS, history=3)
+    for minute, reading in enumerate([[30.0, 20], [18.0, 50], [20.0, 45], [19.0, 55]]):
+        fleet.record("kitchen", datetime(2022, 4, 9, 12, minute), reading)
+    fleet.record("shed", datetime(2022, 4, 9, 12, 0), [5.0, float("nan")])
+    (kitchen_id, _, _, count, low, high), (shed_id, _, latest, _, shed_low, shed_high) = \
+        fleet.overview()
+    # the first reading has dropped out of the ring
+    assert count == 4 and low == [18.0, 45.0] and high == [20.0, 55.0]
+    assert shed_low[0] == shed_high[0] == 5.0
+    assert isnan(latest[1]) and isnan(shed_low[1]) and isnan(shed_high[1])
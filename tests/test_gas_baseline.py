@@ -0,0 +1,61 @@
+import json
+
+from gas_baseline import GasBaseline
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def fixed(humidity, gas):
+    return 50.0
+
+
+def test_restored_baseline_scores_during_warm_up(tmp_path):
+    path = str(tmp_path / "gas_baseline.json")
+    with open(path, "w") as f:
+        json.dump({"baseline": GasBaseline().compensate(40, 100000), "count": 50000}, f)
+    clock = Clock()
+    baseline = GasBaseline(path, fallback=fixed, clock=clock)
+    for seconds in range(0, 300, 60):
+        clock.now = 1000 + seconds
+        assert baseline.score(40, 100000) == 99.9
+    # warm up readings aren't learnt from
+    assert baseline.count == 50000
+
+
+def test_cold_start_uses_fallback_until_there_is_a_baseline():
+    clock = Clock()
+    baseline = GasBaseline(warmup=300, fallback=fixed, clock=clock)
+    assert baseline.score(40, 0) == 50.0
+    assert baseline.score(40, 60000) == 50.0
+    clock.now += 300
+    score = baseline.score(40, 60000)
+    assert score != 50.0 and score > 90
+    # unstable gas readings repeat the last score
+    assert baseline.score(40, 0) == score
+
+
+def test_restored_baseline_first_reading_unstable_gas(tmp_path):
+    path = str(tmp_path / "gas_baseline.json")
+    with open(path, "w") as f:
+        json.dump({"baseline": GasBaseline().compensate(40, 100000), "count": 50000}, f)
+    clock = Clock()
+    baseline = GasBaseline(path, fallback=fixed, clock=clock)
+    assert baseline.score(40, 0) == 50.0
+    # then scored against the restored baseline
+    assert baseline.score(40, 100000) == 99.9
+    assert baseline.score(40, 0) == 99.9
+
+
+def test_no_fallback_scores_humidity_alone():
+    baseline = GasBaseline(clock=Clock())
+    assert baseline.score(40, 60000) == 25.0
+    assert baseline.score(70, 0) == 25.0
+    restored = GasBaseline(clock=Clock())
+    restored.baseline = restored.compensate(40, 100000)
+    assert restored.score(40, 0) == 25.0
@@ -0,0 +1,226 @@
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from history import RingBuffer, Rollup, SegmentStore, bucket_stats, lttb, min_max
+
+CHANNELS = ["temperature", "humidity"]
+START = datetime(2022, 4, 9, 12, 0, 0)
+
+
+def fill(buffer, count):
+    for i in range(count):
+        buffer.append(START + timedelta(seconds=i), [20 + i, 40 + i])
+    return
+
+
+def test_keeps_only_the_newest_rows_in_order():
+    buffer = RingBuffer(CHANNELS, 5)
+    fill(buffer, 12)
+    assert len(buffer) == 5 and buffer.total == 12
+    times, (temperature, humidity) = buffer.read(CHANNELS)
+    assert list(temperature) == [27, 28, 29, 30, 31]
+    assert list(humidity) == [47, 48, 49, 50, 51]
+    assert times[0] == np.datetime64(START + timedelta(seconds=7), "ms")
+
+
+def test_read_between_times():
+    buffer = RingBuffer(CHANNELS, 10)
+    fill(buffer, 10)
+    times, (temperature,) = buffer.read(["temperature"], since=START + timedelta(seconds=3),
+                                        until=START + timedelta(seconds=6))
+    assert list(temperature) == [24, 25, 26]
+
+
+def test_last_and_dict_readings():
+    buffer = RingBuffer(CHANNELS, 3)
+    assert buffer.last() == (None, [0.0, 0.0])
+    buffer.append(START, {"humidity": 55})
+    stamp, row = buffer.last()
+    assert stamp == np.datetime64(START, "ms")
+    assert np.isnan(row[0]) and row[1] == 55
+
+
+def test_first_is_the_oldest_row_kept():
+    buffer = RingBuffer(CHANNELS, 5)
+    assert buffer.first() is None
+    fill(buffer, 3)
+    assert buffer.first() == np.datetime64(START, "ms")
+    buffer.clear()
+    fill(buffer, 12)
+    assert buffer.first() == np.datetime64(START + timedelta(seconds=7), "ms")
+
+
+def test_extend_wraps_round():
+    buffer = RingBuffer(CHANNELS, 4)
+    fill(buffer, 3)
+    times = np.array([np.datetime64(START + timedelta(seconds=10 + i), "ms") for i in range(6)])
+    buffer.extend(times, np.array([np.arange(6), np.arange(6) + 100], dtype=float))
+    times, (temperature, humidity) = buffer.read(CHANNELS)
+    assert list(temperature) == [2, 3, 4, 5]
+    assert list(humidity) == [102, 103, 104, 105]
+
+
+
+def test_shared_buffer_survives_a_worker_exiting():
+    import os
+    import subprocess
+    import sys
+    from history import unlink_shared
+
+    name = "test_history_%d" % os.getpid()
+    buffer = RingBuffer(CHANNELS, 5, name)
+    # a separate program has its own resource tracker, which used to unlink
+    # the segment when the program exited
+    attach = "from history import RingBuffer; print(RingBuffer(%r, 5, %r).total)" % (CHANNELS, name)
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        fill(buffer, 3)
+        for _ in range(2):
+            output = subprocess.run([sys.executable, "-c", attach], cwd=directory,
+                                    capture_output=True, text=True)
+            assert output.stdout.strip() == "3"
+        fill(buffer, 1)
+        assert RingBuffer(CHANNELS, 5, name).total == 4
+    finally:
+        unlink_shared(name)
+
+
+def test_store_reads_back_across_days(tmp_path):
+    store = SegmentStore(str(tmp_path), CHANNELS)
+    midnight = datetime(2022, 4, 10)
+    for i in range(-2, 3):
+        store.append(midnight + timedelta(seconds=i), {"temperature": i})
+    store.close()
+    assert sorted(os.listdir(tmp_path)) == ["2022-04-09.bin", "2022-04-10.bin", "schema.json"]
+    times, (temperature, humidity) = store.read(midnight - timedelta(seconds=1),
+                                                midnight + timedelta(seconds=2))
+    # start is included, stop isn't
+    assert list(temperature) == [-1, 0, 1] and np.isnan(humidity).all()
+    assert times[0] == np.datetime64(midnight - timedelta(seconds=1), "ms")
+    times, values = store.read(midnight + timedelta(days=1), midnight + timedelta(days=2))
+    assert len(times) == 0 and values.shape == (2, 0)
+
+
+def test_store_recovers_a_torn_record(tmp_path):
+    store = SegmentStore(str(tmp_path), CHANNELS)
+    fill(store, 3)
+    store.close()
+    # a power cut part way through writing a record
+    with open(tmp_path / "2022-04-09.bin", "ab") as f:
+        f.write(b"\x01\x02\x03")
+    store = SegmentStore(str(tmp_path), CHANNELS)
+    for i in range(3, 6):
+        store.append(START + timedelta(seconds=i), [20 + i, 40 + i])
+    times, (temperature, humidity) = store.read(START, START + timedelta(minutes=1))
+    assert list(temperature) == [20, 21, 22, 23, 24, 25]
+    assert list(times) == [np.datetime64(START + timedelta(seconds=i), "ms") for i in range(6)]
+
+
+def test_store_rejects_different_channels(tmp_path):
+    SegmentStore(str(tmp_path), CHANNELS)
+    with pytest.raises(ValueError):
+        SegmentStore(str(tmp_path), CHANNELS + ["gas"])
+
+
+def test_rollup_keeps_the_spread_of_summaries():
+    hourly = Rollup(["temperature"], 3600, 10)
+    # two minute rollups from a sensor, (mean, min, max, count)
+    hourly.add(START, [20.0], [18.0], [23.0], 60)
+    hourly.add(START + timedelta(minutes=1), [21.0], [19.5], [22.0], 20)
+    hourly.flush()
+    times, (low, high, mean) = hourly.data.read(hourly.columns)
+    assert list(low) == [18.0] and list(high) == [23.0]
+    assert list(mean) == [pytest.approx((20.0 * 60 + 21.0 * 20) / 80)]
+
+
+def test_bucket_stats_combine_rows_into_buckets():
+    rng = np.random.default_rng(1)
+    start = np.datetime64(START, "ms")
+    # minute rows with a gap, so the second hour has fewer rows and the
+    # third none at all
+    minutes = np.r_[0:60, 70:100, 185:200]
+    times = start + minutes * np.timedelta64(60, "s")
+    mean = rng.uniform(10, 30, len(times))
+    low, high = mean - rng.uniform(0, 2, len(times)), mean + rng.uniform(0, 2, len(times))
+    bucket_times, stats = bucket_stats(times, low, high, mean, start, np.timedelta64(1, "h"),
+                                       quantiles=[0, 0.5, 0.95, 1])
+    hours = [0, 1, 3]
+    assert list(bucket_times) == [start + np.timedelta64(hour, "h") for hour in hours]
+    for i, hour in enumerate(hours):
+        rows = minutes // 60 == hour
+        assert stats["min"][i] == low[rows].min() and stats["max"][i] == high[rows].max()
+        assert stats["mean"][i] == pytest.approx(mean[rows].mean())
+        for q in [0, 0.5, 0.95, 1]:
+            assert stats["p%g" % (q * 100)][i] == pytest.approx(np.quantile(mean[rows], q))
+
+
+def test_bucket_stats_of_nothing():
+    empty = np.zeros(0)
+    bucket_times, stats = bucket_stats(np.zeros(0, dtype="datetime64[ms]"), empty, empty, empty,
+                                       np.datetime64(START, "ms"), np.timedelta64(1, "h"), [0.5])
+    assert len(bucket_times) == 0 and len(stats["p50"]) == 0
+
+
+def test_rollup_buckets_start_on_the_boundary():
+    rollup = Rollup(["temperature"], 60, 10)
+    for offset, reading in [(-1, 5.0), (0, 10.0), (59.999, 20.0), (60, 30.0)]:
+        rollup.add(START + timedelta(seconds=offset), [reading])
+    # the bucket starting at 12:01 is still open
+    times, (low, high, mean) = rollup.data.read(rollup.columns)
+    assert list(times) == [np.datetime64(START - timedelta(minutes=1), "ms"),
+                           np.datetime64(START, "ms")]
+    assert list(low) == [5, 10] and list(high) == [5, 20] and list(mean) == [5, 15]
+    rollup.flush()
+    rollup.flush()
+    assert rollup.data.total == 3
+
+
+def test_rollup_read_includes_start_not_stop(tmp_path):
+    rollup = Rollup(["temperature"], 60, 3, str(tmp_path))
+    for minute in range(6):
+        rollup.add(START + timedelta(minutes=minute), [minute])
+    rollup.flush()
+
+    def read(first, last):
+        times, (mean,) = rollup.read(START + timedelta(minutes=first),
+                                     START + timedelta(minutes=last), ["temperature_mean"])
+        return list(mean)
+    # from memory (the last 3 buckets), then going further back from disk
+    assert read(3, 5) == [3, 4]
+    assert read(4, 10) == [4, 5]
+    assert read(1, 4) == [1, 2, 3]
+    assert read(0, 6) == [0, 1, 2, 3, 4, 5]
+    # a start part way through a bucket leaves it out
+    assert rollup.read(START + timedelta(minutes=3, milliseconds=1), START + timedelta(minutes=6),
+                       ["temperature_mean"])[1][0].tolist() == [4, 5]
+
+
+def test_lttb_keeps_the_ends_and_the_peaks():
+    x = np.arange(1000)
+    y = np.sin(x / 50.0)
+    y[437] = 10.0
+    chosen = lttb(x, y, 50)
+    assert len(chosen) == 50 and chosen[0] == 0 and chosen[-1] == 999
+    assert np.all(np.diff(chosen) > 0)
+    assert 437 in chosen
+    # nothing to do for short series
+    assert list(lttb(x[:10], y[:10], 50)) == list(range(10))
+
+
+def test_min_max_keeps_each_buckets_extremes_in_order():
+    rng = np.random.default_rng(2)
+    low = rng.uniform(0, 10, 1000)
+    high = low + 1
+    indices, values = min_max(low, high, 100)
+    assert len(indices) == 200 and np.all(np.diff(indices) >= 0)
+    for bucket in range(100):
+        block = slice(bucket * 10, bucket * 10 + 10)
+        pair = sorted(values[2 * bucket:2 * bucket + 2])
+        assert pair == [low[block].min(), high[block].max()]
+    # the values are the lows and highs at the chosen indices
+    assert all(value in (low[i], high[i]) for i, value in zip(indices, values))
+    indices, values = min_max(low[:50], high[:50], 100)
+    assert list(indices) == list(range(50)) and list(values) == list(high[:50])
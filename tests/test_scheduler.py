@@ -0,0 +1,92 @@
+from scheduler import Scheduler
+
+
+class Clock:
+    # fake monotonic clock, sleep() moves it on
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def make():
+    clock = Clock()
+    return clock, Scheduler(clock=clock, sleeper=clock.sleep)
+
+
+def test_deadlines_dont_drift():
+    clock, scheduler = make()
+    started = []
+
+    def sample():
+        started.append(clock.now)
+        # each run takes part of the period
+        clock.now += 0.3
+    scheduler.add("sample", 1.0, sample, delay=1)
+    for _ in range(5):
+        scheduler.run_once()
+    assert started == [101.0, 102.0, 103.0, 104.0, 105.0]
+    stats = scheduler.stats()["sample"]
+    assert stats["runs"] == 5 and stats["max_ms"] == 0 and stats["overruns"] == 0
+
+
+def test_runs_missed_by_an_overrun_are_skipped():
+    clock, scheduler = make()
+    started = []
+
+    def sample():
+        started.append(clock.now)
+        if len(started) == 2:
+            clock.now += 2.5
+    scheduler.add("sample", 1.0, sample)
+    for _ in range(4):
+        scheduler.run_once()
+    # the run at 101 takes until 103.5, so 102 and 103 are skipped rather
+    # than run back to back
+    assert started == [100.0, 101.0, 104.0, 105.0]
+    assert scheduler.stats()["sample"]["overruns"] == 2
+
+
+def test_late_starts_are_recorded_as_jitter():
+    clock, scheduler = make()
+    scheduler.add("sample", 1.0, lambda: None)
+    scheduler.sleeper = lambda seconds: clock.sleep(seconds + 0.01)
+    for _ in range(3):
+        scheduler.run_once()
+    stats = scheduler.stats()["sample"]
+    assert stats["runs"] == 3 and stats["max_ms"] == 10.0
+
+
+def test_defer_reorders_the_queue():
+    clock, scheduler = make()
+    order = []
+    scheduler.add("display", 1.0, lambda: order.append(("display", clock.now)), delay=0.5)
+    scheduler.add("sample", 1.0, lambda: order.append(("sample", clock.now)), delay=1)
+    scheduler.defer("display", 2)
+    scheduler.run_once()
+    scheduler.run_once()
+    assert order == [("sample", 101.0), ("display", 102.0)]
+    # deferring never brings a run forward
+    scheduler.defer("display", 0.5)
+    assert scheduler.tasks["display"].deadline == 103.0
+
+
+def test_task_deferred_while_waiting_isnt_run_early():
+    clock, scheduler = make()
+    ran = []
+    scheduler.add("display", 1.0, lambda: ran.append(clock.now), delay=1)
+
+    def sleeper(seconds):
+        # e.g. a button press handled while waiting
+        clock.sleep(seconds / 2)
+        scheduler.defer("display", 5)
+    scheduler.sleeper = sleeper
+    scheduler.run_once()
+    assert ran == []
+    scheduler.sleeper = clock.sleep
+    scheduler.run_once()
+    assert ran == [105.5]
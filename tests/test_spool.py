@@ -0,0 +1,82 @@
+import os
+
+from spool import Spool, HEADER
+
+
+def read_all(spool):
+    messages = []
+    while True:
+        message = spool.peek()
+        if message is None:
+            return messages
+        messages.append(message)
+        spool.advance()
+
+
+def test_messages_come_back_in_order_across_segments(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=100)
+    sent = [("message %d" % i).encode() * 3 for i in range(20)]
+    for message in sent:
+        spool.append(message)
+    assert len([n for n in os.listdir(str(tmp_path)) if n.endswith(".seg")]) > 1
+    assert read_all(spool) == sent
+    assert len(spool) == 0
+
+
+def test_unread_messages_survive_reopening(tmp_path):
+    spool = Spool(str(tmp_path))
+    for i in range(5):
+        spool.append(b"reading %d" % i)
+    spool.peek()
+    spool.advance()
+    spool.sync()
+    spool = Spool(str(tmp_path))
+    assert read_all(spool) == [b"reading %d" % i for i in range(1, 5)]
+
+
+def test_reopen_after_torn_write(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(b"first")
+    spool.append(b"second")
+    spool.sync()
+    # a power cut part way through writing a record's header and message
+    path = os.path.join(str(tmp_path), "00000000.seg")
+    with open(path, "ab") as f:
+        f.write(HEADER.pack(0x5AA5, 64, 0)[:7])
+    size = os.path.getsize(path)
+
+    spool = Spool(str(tmp_path))
+    assert os.path.getsize(path) == size - 7
+    spool.append(b"third")
+    assert read_all(spool) == [b"first", b"second", b"third"]
+    assert spool.corrupt == 0
+
+
+def test_torn_message_is_cut_off(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(b"first")
+    spool.sync()
+    path = os.path.join(str(tmp_path), "00000000.seg")
+    with open(path, "ab") as f:
+        f.write(HEADER.pack(0x5AA5, 64, 0) + b"only part of the message")
+
+    spool = Spool(str(tmp_path))
+    for i in range(10):
+        spool.append(b"after %d" % i)
+    assert read_all(spool) == [b"first"] + [b"after %d" % i for i in range(10)]
+
+
+def test_corrupt_record_is_skipped(tmp_path):
+    spool = Spool(str(tmp_path))
+    for message in [b"one", b"two", b"three"]:
+        spool.append(message)
+    spool.sync()
+    # flip a byte in the middle record's message
+    path = os.path.join(str(tmp_path), "00000000.seg")
+    with open(path, "r+b") as f:
+        f.seek(2 * HEADER.size + 3 + 1)
+        f.write(b"X")
+
+    spool = Spool(str(tmp_path))
+    assert read_all(spool) == [b"one", b"three"]
+    assert spool.corrupt == 1
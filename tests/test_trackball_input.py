@@ -0,0 +1,81 @@
+from trackball_input import FakeGPIO, TrackballInput
+
+PIN = 4
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Trackball:
+    # returns each reading set by the test, in the trackball library's
+    # order (up, down, left, right, switch, state)
+    def __init__(self):
+        self.reading = (0, 0, 0, 0, 0, 0)
+        self.reads = 0
+
+    def read(self):
+        self.reads += 1
+        return self.reading
+
+
+def make(long_press):
+    gpio = FakeGPIO()
+    trackball = Trackball()
+    clock = Clock()
+    trackball_input = TrackballInput(trackball, PIN, gpio, long_press=long_press, clock=clock)
+    return gpio, trackball, clock, trackball_input
+
+
+def button(gpio, trackball, clock, state):
+    clock.now += 0.1
+    trackball.reading = (0, 0, 0, 0, state, state)
+    gpio.trigger(PIN)
+    return
+
+
+def test_press_and_release():
+    gpio, trackball, clock, trackball_input = make(long_press=5)
+    button(gpio, trackball, clock, 1)
+    assert trackball_input.get(timeout=0) is None
+    button(gpio, trackball, clock, 0)
+    assert trackball_input.get(timeout=0) == ("press", None)
+    assert trackball_input.get(timeout=0) is None
+
+
+def test_long_press_isnt_also_a_press():
+    gpio, trackball, clock, trackball_input = make(long_press=0.05)
+    button(gpio, trackball, clock, 1)
+    assert trackball_input.get(timeout=2) == ("long_press", None)
+    button(gpio, trackball, clock, 0)
+    assert trackball_input.get(timeout=0.2) is None
+    # the next short press is reported as usual
+    trackball_input.long_press = 5
+    button(gpio, trackball, clock, 1)
+    button(gpio, trackball, clock, 0)
+    assert trackball_input.get(timeout=0) == ("press", None)
+
+
+def test_motion():
+    gpio, trackball, clock, trackball_input = make(long_press=5)
+    # rolled 3 down and 1 left
+    trackball.reading = (0, 3, 1, 0, 0, 0)
+    gpio.trigger(PIN)
+    assert trackball_input.get(timeout=0) == ("motion", (-1, 3))
+    # other pins aren't the trackball's
+    gpio.trigger(PIN + 1)
+    assert trackball_input.get(timeout=0) is None
+
+
+def test_reads_once_at_start_to_clear_the_interrupt():
+    gpio = FakeGPIO()
+    trackball = Trackball()
+    # moved before the input was set up, so the pin is already low
+    trackball.reading = (1, 0, 0, 0, 0, 0)
+    trackball_input = TrackballInput(trackball, PIN, gpio, clock=Clock())
+    assert trackball.reads == 1
+    assert trackball_input.get(timeout=0) == ("motion", (0, -1))
@@ -0,0 +1,103 @@
+"""
+Interrupt-driven trackball input for the Environment Sensor
+
+The trackball pulls its interrupt pin low whenever it is moved or the button
+changes, so it only needs to be read over I2C when something has happened.
+Presses, long presses and movement are turned into events on a queue for the
+main loop to handle.
+"""
+
+import queue
+import threading
+from time import monotonic
+
+# =====================================================================
+### Trackball input class ####################
+
+class TrackballInput:
+    """
+    queues trackball events from the interrupt pin...
+        ("press", None)          button pressed and released
+        ("long_press", None)     button held for long_press seconds
+        ("motion", (dx, dy))     trackball rolled
+    gpio is the RPi.GPIO module, or FakeGPIO for testing off the Pi
+    """
+
+    def __init__(self, trackball, pin, gpio=None, long_press=0.5, clock=monotonic):
+        if gpio is None:
+            import RPi.GPIO as gpio
+        self.trackball = trackball
+        self.long_press = long_press
+        self.clock = clock
+        self.events = queue.Queue(maxsize=64)
+        self.press_start = None
+        self.long_reported = False
+        self.lock = threading.Lock()
+        gpio.add_event_detect(pin, gpio.FALLING, callback=self._interrupt)
+        # the pin is edge triggered, if it is already low (the ball moved
+        # since it was last read) no new edge would come until it's read
+        self._interrupt(pin)
+
+    def _put(self, event):
+        # drop events rather than block the GPIO thread if nobody is reading
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            pass
+        return
+
+    def _interrupt(self, channel):
+        # reading the trackball also clears the interrupt
+        up, down, left, right, switch, state = self.trackball.read()
+        if left or right or up or down:
+            self._put(("motion", (right - left, down - up)))
+        with self.lock:
+            if state and self.press_start is None:
+                started = self.press_start = self.clock()
+                self.long_reported = False
+                timer = threading.Timer(self.long_press, self._check_long_press, [started])
+                timer.daemon = True
+                timer.start()
+            elif not state and self.press_start is not None:
+                if not self.long_reported:
+                    self._put(("press", None))
+                self.press_start = None
+        return
+
+    def _check_long_press(self, started):
+        # runs long_press seconds after a press, still held means long press
+        with self.lock:
+            if self.press_start == started:
+                self.long_reported = True
+                self._put(("long_press", None))
+        return
+
+    def get(self, timeout=None):
+        # next event, or None if there isn't one within timeout seconds
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+# =====================================================================
+### GPIO stand-in for testing ################
+
+class FakeGPIO:
+    """
+    minimal stand-in for RPi.GPIO (also installed by simulation.py), call
+    trigger(pin) to fire an interrupt. pins without a callback are ignored
+    """
+
+    FALLING = "falling"
+
+    def __init__(self):
+        self.callbacks = {}
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = callback
+        return
+
+    def trigger(self, pin):
+        if pin in self.callbacks:
+            self.callbacks[pin](pin)
+        return